@@ -1,19 +1,40 @@
 import os
+import sys
 import base64
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash,session, send_file, jsonify
+from datetime import datetime, timedelta
+from flask import Flask, Request, render_template, request, redirect, url_for, flash,session, send_file, jsonify, Response, stream_with_context, g, before_render_template, template_rendered
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo import MongoClient
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from pymongo import MongoClient, ReturnDocument
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from PIL import Image
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
 from bson import ObjectId
 import openai
+import requests
+from requests.adapters import HTTPAdapter
+from vision_scoring import build_question_index, score_quiz
+import generate_vision_questions as question_gen
+import vision_analytics
+from metrics import (MongoStageListener, begin_request, end_request, inc, observe,
+                     record_stage, render_prometheus, stage, timed_stage)
 import pandas as pd
+import io
+import uuid
 import random
 import json
+import mimetypes
+import hashlib
+import difflib
+import re
+import threading
+import time
+import weakref
+from types import MappingProxyType
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
 
 
 # Load env
@@ -27,39 +48,478 @@ SECRET_KEY = os.getenv("SECRET_KEY", "change_this_in_prod")
 # Flask app
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+UPLOAD_MAX_BYTES = 16 * 1024 * 1024   # per request, and per file in a batch
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES
 
 ALLOWED_EXT = {'png', 'jpg', 'jpeg'}
-UPLOAD_FOLDER = os.path.join("static", "uploads")
-REPORT_FOLDER = "reports"
+# links to originals ("/<filepath>") assume the default under static/
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join("static", "uploads"))
+NORMALIZED_FOLDER = os.path.join(UPLOAD_FOLDER, "normalized")
+THUMB_FOLDER = os.path.join(UPLOAD_FOLDER, "thumbs")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(REPORT_FOLDER, exist_ok=True)
+os.makedirs(NORMALIZED_FOLDER, exist_ok=True)
+os.makedirs(THUMB_FOLDER, exist_ok=True)
 
 # MongoDB
-mongo = MongoClient(MONGO_URI)
+mongo = MongoClient(MONGO_URI, event_listeners=[MongoStageListener()])
 db = mongo['eye_ai_db']
 users_col = db['users']
 images_col = db['images']
 vision_col = db['vision_tests']
 profiles_col = db['patient_profiles']
+analysis_jobs_col = db['analysis_jobs']
+analysis_cache_col = db['analysis_cache']
+quiz_states_col = db['quiz_states']
+chats_col = db['chat_history']
+chat_cache_col = db['chat_cache']
+chat_streams_col = db['chat_streams']
+vision_reports_col = db['vision_reports']
+user_summaries_col = db['user_summaries']
+
+# -------------------- Indexes --------------------
+# (collection, keys, options) -- created by ensure_indexes() on startup and by
+# `python check_indexes.py`, which also explains HOT_QUERIES and fails on COLLSCAN.
+ANALYSIS_CACHE_TTL_DAYS = int(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "90"))
+ANALYSIS_JOB_TTL_DAYS = int(os.getenv("ANALYSIS_JOB_TTL_DAYS", "7"))
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "1") != "0"
+
+MONGO_INDEXES = [
+    (users_col, [("username", 1)], {"unique": True}),
+    (profiles_col, [("username", 1)], {"unique": True}),
+    (images_col, [("username", 1), ("created_at", -1)], {}),
+    (images_col, [("created_at", -1), ("_id", -1)], {}),
+    (images_col, [("tech_validated", 1), ("created_at", -1), ("_id", -1)], {}),
+    (vision_col, [("username", 1), ("created_at", -1)], {}),
+    (vision_col, [("created_at", -1)], {}),
+    (analysis_jobs_col, [("status", 1), ("created_at", 1)], {}),
+    # done/failed jobs only; queued and running jobs have no finished_at
+    (analysis_jobs_col, [("finished_at", 1)],
+     {"expireAfterSeconds": ANALYSIS_JOB_TTL_DAYS * 24 * 3600}),
+    (analysis_cache_col, [("last_used_at", 1)],
+     {"expireAfterSeconds": ANALYSIS_CACHE_TTL_DAYS * 24 * 3600}),
+    (quiz_states_col, [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    (chat_streams_col, [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    (chat_cache_col, [("expires_at", 1)], {"expireAfterSeconds": 0}),
+]
+
+def _analysis_claim_filter(now, stale):
+    """Jobs a worker may claim: queued and due, or running with a lease older than stale."""
+    return {"$or": [
+        # jobs queued before retry_after existed have none and match too
+        {"status": "queued", "retry_after": {"$not": {"$gt": now}}},
+        {"status": "running", "locked_at": {"$lt": stale}}
+    ]}
+
+# (collection, filter, sort) for the queries behind the app's hot paths
+HOT_QUERIES = [
+    (users_col, {"username": "x"}, None),
+    (profiles_col, {"username": "x"}, None),
+    (images_col, {"username": "x"}, [("created_at", -1)]),
+    (images_col, {}, [("created_at", -1), ("_id", -1)]),
+    (images_col, {"tech_validated": True}, [("created_at", -1), ("_id", -1)]),
+    (vision_col, {"username": "x"}, [("created_at", -1)]),
+    (vision_col, {"created_at": {"$gte": datetime(2000, 1, 1)}}, None),
+    (analysis_jobs_col, _analysis_claim_filter(datetime(2000, 1, 1), datetime(2000, 1, 1)), [("created_at", 1)]),
+    (analysis_cache_col, {}, [("last_used_at", 1)]),
+]
+
+_indexes_pid = None
+
+def ensure_indexes():
+    """Create every index in MONGO_INDEXES; returns [(collection, keys, error)] for the ones that failed."""
+    failed = []
+    for col, keys, opts in MONGO_INDEXES:
+        try:
+            col.create_index(keys, **opts)
+        except Exception as e:
+            app.logger.warning("index %s on %s failed: %s", keys, col.name, e)
+            failed.append((col.name, keys, e))
+    return failed
+
+def ensure_indexes_once():
+    global _indexes_pid
+    if not ENSURE_INDEXES or _indexes_pid == os.getpid():
+        return
+    _indexes_pid = os.getpid()
+    failed = ensure_indexes()
+    if failed:
+        app.logger.warning("index bootstrap: %d of %d indexes failed", len(failed), len(MONGO_INDEXES))
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for v in plan.values():
+            yield from _plan_stages(v)
+    elif isinstance(plan, list):
+        for v in plan:
+            yield from _plan_stages(v)
+
+def find_collscans():
+    """Explain every HOT_QUERIES entry; return descriptions of those that COLLSCAN."""
+    bad = []
+    for col, flt, sort in HOT_QUERIES:
+        cur = col.find(flt)
+        if sort:
+            cur = cur.sort(sort)
+        winning = cur.explain().get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_plan_stages(winning)):
+            bad.append(f"{col.name} filter={flt} sort={sort}")
+    return bad
 
 
 # -------------------- Helpers --------------------
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXT
 
+# ---- Upload storage ----
+# Uploads are content-addressed: static/uploads/<h[:2]>/<h[2:4]>/<sha256>.<ext>.
+# The stream is read once, hashed and written in the same pass; identical
+# bytes map to the same file. The bytes are also kept in a small in-process
+# cache so the analysis worker does not read the file back from disk.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+RECENT_UPLOAD_CACHE_BYTES = int(os.getenv("RECENT_UPLOAD_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+_recent_uploads = OrderedDict()   # sha256 -> bytes
+_recent_uploads_bytes = 0
+_recent_uploads_lock = threading.Lock()
+
+def upload_rel_path(sha256, ext):
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.{ext}")
+
+def remember_upload_bytes(sha256, data):
+    global _recent_uploads_bytes
+    if len(data) > RECENT_UPLOAD_CACHE_BYTES:
+        return
+    with _recent_uploads_lock:
+        if sha256 in _recent_uploads:
+            _recent_uploads.move_to_end(sha256)
+            return
+        _recent_uploads[sha256] = data
+        _recent_uploads_bytes += len(data)
+        while _recent_uploads_bytes > RECENT_UPLOAD_CACHE_BYTES:
+            _, old = _recent_uploads.popitem(last=False)
+            _recent_uploads_bytes -= len(old)
+
+def recent_upload_bytes(sha256):
+    with _recent_uploads_lock:
+        return _recent_uploads.get(sha256) if sha256 else None
+
+@timed_stage("upload.save_file")
 def save_file_storage(fs):
-    fname = secure_filename(fs.filename)
-    ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    out = f"{ts}_{fname}"
-    path = os.path.join(UPLOAD_FOLDER, out)
-    fs.save(path)
-    return path, out
+    """
+    Store an upload content-addressed in a single pass over its stream.
+    Returns (path, filename relative to UPLOAD_FOLDER, sha256, bytes).
+    """
+    ext = secure_filename(fs.filename).rsplit(".", 1)[-1].lower()
+    tmp = os.path.join(UPLOAD_FOLDER, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    chunks = []
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                chunk = fs.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                chunks.append(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        out = upload_rel_path(sha256, ext)
+        path = os.path.join(UPLOAD_FOLDER, out)
+        if os.path.exists(path):
+            os.remove(tmp)   # same bytes already stored
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    data = b"".join(chunks)
+    remember_upload_bytes(sha256, data)
+    return path, out, sha256, data
+
+# ---- CPU-bound work under gevent workers ----
+# With gunicorn's gevent workers (gunicorn.conf.py) every request is a
+# greenlet on one hub, so a long Pillow/reportlab call would stall every
+# in-flight AI request in the process. Such calls go to gevent's native
+# thread pool; fn must not touch app locks or metrics (time it outside).
+def gevent_active():
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+def run_cpu_bound(fn, *args):
+    if gevent_active():
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+def wants_cache_bypass(req):
+    return str(req.values.get("no_cache", "")).lower() in ("1", "true", "yes", "on")
+
+# ---- Image normalization (before the vision call) ----
+ANALYSIS_MAX_EDGE = int(os.getenv("ANALYSIS_MAX_EDGE", "1024"))
+ANALYSIS_IMAGE_FORMAT = os.getenv("ANALYSIS_IMAGE_FORMAT", "JPEG").upper()  # JPEG or WEBP
+ANALYSIS_IMAGE_QUALITY = int(os.getenv("ANALYSIS_IMAGE_QUALITY", "85"))
+
+@timed_stage("image.normalize")
+def normalize_image_for_analysis(image_path, data=None):
+    """
+    Write a bounded-size copy of image_path for the AI call:
+    EXIF orientation applied, longest edge <= ANALYSIS_MAX_EDGE, re-encoded as
+    JPEG/WebP. data, when given, is the upload's bytes and saves re-reading it.
+    Returns (normalized path, normalized bytes); the original is kept as-is.
+    """
+    ext = "webp" if ANALYSIS_IMAGE_FORMAT == "WEBP" else "jpg"
+    # mirror the upload's <h[:2]>/<h[2:4]>/ shard, like the thumbnails do
+    rel = os.path.relpath(image_path, UPLOAD_FOLDER)
+    if rel.startswith(os.pardir):
+        rel = os.path.basename(image_path)
+    out = os.path.join(NORMALIZED_FOLDER, f"{os.path.splitext(rel)[0]}.{ext}")
+    if os.path.exists(out):
+        with open(out, "rb") as f:
+            return out, f.read()
+
+    encoded = run_cpu_bound(_encode_for_analysis, io.BytesIO(data) if data is not None else image_path, ext)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    tmp = f"{out}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(encoded)
+    os.replace(tmp, out)
+    return out, encoded
+
+def _encode_for_analysis(source, ext):
+    with Image.open(source) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        im.thumbnail((ANALYSIS_MAX_EDGE, ANALYSIS_MAX_EDGE), Image.LANCZOS)
+        buf = io.BytesIO()
+        if ext == "webp":
+            im.save(buf, "WEBP", quality=ANALYSIS_IMAGE_QUALITY, method=4)
+        else:
+            im.save(buf, "JPEG", quality=ANALYSIS_IMAGE_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+# ---- Thumbnails (generated lazily, cached on disk) ----
+THUMB_SIZES = {"sm": 160, "md": 320, "lg": 640}
+THUMB_MAX_AGE = 365 * 24 * 3600
+# derived files live under UPLOAD_FOLDER too but are never thumbnail sources
+_DERIVED_UPLOAD_DIRS = {os.path.basename(THUMB_FOLDER), os.path.basename(NORMALIZED_FOLDER)}
+
+@timed_stage("image.thumbnail")
+def thumbnail_path(filename, size):
+    """Return the cached thumbnail for an upload, rendering it on first use."""
+    src = safe_join(UPLOAD_FOLDER, filename)
+    if src is None or not os.path.isfile(src):
+        return None
+    if os.path.relpath(src, UPLOAD_FOLDER).split(os.sep, 1)[0] in _DERIVED_UPLOAD_DIRS:
+        return None
+    out = os.path.join(THUMB_FOLDER, size, os.path.splitext(filename)[0] + ".jpg")
+    if os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(src):
+        return out
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    run_cpu_bound(_write_thumbnail, src, out, THUMB_SIZES[size])
+    return out
+
+def _write_thumbnail(src, out, edge):
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        im.thumbnail((edge, edge), Image.LANCZOS)
+        tmp = out + ".tmp"
+        im.save(tmp, "JPEG", quality=80, optimize=True, progressive=True)
+    os.replace(tmp, out)
+
+def image_mime_type(image_path):
+    return mimetypes.guess_type(image_path)[0] or "image/jpeg"
+
+# -------------------- OpenAI client --------------------
+# Every model call goes through openai_chat(): one pooled HTTP session, a
+# per-call timeout, jittered exponential backoff on transient errors, a global
+# and per-user concurrency cap, and a circuit breaker that fails fast with
+# OpenAIUnavailable while the upstream keeps failing.
+OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_CAP = float(os.getenv("OPENAI_BACKOFF_CAP", "8"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_PER_USER_CONCURRENCY = int(os.getenv("OPENAI_PER_USER_CONCURRENCY", "2"))
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30"))
+OPENAI_BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+
+class _PersistentSession(requests.Session):
+    """
+    openai 0.28 closes its session every MAX_SESSION_LIFETIME_SECS (180 s) per
+    thread; with one shared session that would flush the pool for everyone.
+    """
+    def close(self):
+        pass
+
+_openai_http = _PersistentSession()
+_openai_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=OPENAI_MAX_CONCURRENCY))
+_openai_http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=OPENAI_MAX_CONCURRENCY))
+openai.requestssession = _openai_http
+
+_openai_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+_openai_user_slots = weakref.WeakValueDictionary()
+_openai_user_slots_lock = threading.Lock()
+
+_breaker = {"failures": 0, "opened_at": None, "probing": False}
+_breaker_lock = threading.Lock()
+
+_RETRYABLE_OPENAI_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+class OpenAIUnavailable(Exception):
+    """Raised instead of calling the model while the breaker is open or slots are exhausted."""
+
+def _breaker_allow():
+    with _breaker_lock:
+        if _breaker["opened_at"] is None:
+            return True
+        if time.monotonic() - _breaker["opened_at"] < OPENAI_BREAKER_COOLDOWN or _breaker["probing"]:
+            return False
+        # half-open: let a single probe call through
+        _breaker["probing"] = True
+        return True
+
+def _breaker_record(ok):
+    with _breaker_lock:
+        _breaker["probing"] = False
+        if ok:
+            _breaker["failures"] = 0
+            _breaker["opened_at"] = None
+            return
+        _breaker["failures"] += 1
+        if _breaker["failures"] >= OPENAI_BREAKER_THRESHOLD:
+            _breaker["opened_at"] = time.monotonic()
+
+def openai_breaker_state():
+    with _breaker_lock:
+        if _breaker["opened_at"] is None:
+            return "closed"
+        return "half_open" if _breaker["probing"] else "open"
+
+def _user_slot(user):
+    with _openai_user_slots_lock:
+        slot = _openai_user_slots.get(user)
+        if slot is None:
+            slot = threading.BoundedSemaphore(OPENAI_PER_USER_CONCURRENCY)
+            _openai_user_slots[user] = slot
+        return slot
+
+_openai_budget = threading.local()
+
+@contextmanager
+def openai_budget(semaphore):
+    """Within the block, calls on this thread use semaphore instead of the caller's per-user slot."""
+    previous = getattr(_openai_budget, "slot", None)
+    _openai_budget.slot = semaphore
+    try:
+        yield
+    finally:
+        _openai_budget.slot = previous
+
+def _acquire_openai_slots(user):
+    # per-user slot first: a user waiting on their own cap must not sit on a
+    # global slot that another user could be using
+    slot = getattr(_openai_budget, "slot", None)
+    if slot is None and user is not None:
+        slot = _user_slot(user)
+    if slot is not None and not slot.acquire(timeout=OPENAI_QUEUE_TIMEOUT):
+        raise OpenAIUnavailable("too many concurrent AI requests for this user")
+    if not _openai_slots.acquire(timeout=OPENAI_QUEUE_TIMEOUT):
+        if slot is not None:
+            slot.release()
+        raise OpenAIUnavailable("too many concurrent AI requests")
+    return slot
+
+def _release_openai_slots(slot):
+    _openai_slots.release()
+    if slot is not None:
+        slot.release()
+
+def _openai_create(messages, stream):
+    """ChatCompletion.create with retries and breaker accounting (slots already held)."""
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        if not _breaker_allow():
+            raise OpenAIUnavailable("AI service temporarily unavailable")
+        try:
+            response = openai.ChatCompletion.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                stream=stream,
+                request_timeout=OPENAI_TIMEOUT
+            )
+        except _RETRYABLE_OPENAI_ERRORS:
+            _breaker_record(False)
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            # full jitter
+            time.sleep(random.uniform(0, min(OPENAI_BACKOFF_CAP, OPENAI_BACKOFF_BASE * 2 ** attempt)))
+            continue
+        except Exception:
+            # request errors (bad input, auth) say nothing about upstream health
+            _breaker_record(True)
+            raise
+        if not stream:
+            # a stream is only a success once it has been read (openai_chat_stream)
+            _breaker_record(True)
+        return response
+
+def openai_chat(messages, user=None):
+    """Return the assistant message text for messages."""
+    slot = _acquire_openai_slots(user)
+    try:
+        response = _openai_create(messages, stream=False)
+    finally:
+        _release_openai_slots(slot)
+    return response["choices"][0]["message"]["content"]
+
+def openai_chat_stream(messages, user=None):
+    """Yield assistant text chunks; the concurrency slots are held until the stream ends."""
+    slot = _acquire_openai_slots(user)
+    try:
+        stream = _openai_create(messages, stream=True)
+        failed = False
+        try:
+            for chunk in stream:
+                token = chunk["choices"][0].get("delta", {}).get("content")
+                if token:
+                    yield token
+        except (_RETRYABLE_OPENAI_ERRORS + (requests.exceptions.RequestException,)):
+            # a stream that dies mid-answer is an upstream failure too
+            failed = True
+            _breaker_record(False)
+            raise
+        finally:
+            # also when the client went away early, so a half-open probe is settled
+            if not failed:
+                _breaker_record(True)
+    finally:
+        _release_openai_slots(slot)
 
 # -------------------- AI FUNCTIONS --------------------
-def call_openai_image_analysis_localfile(image_path):
-    with open(image_path, "rb") as f:
-        b64_img = base64.b64encode(f.read()).decode()
+@timed_stage("openai.image_analysis")
+def call_openai_image_analysis_localfile(image_path, user=None, data=None):
+    if data is None:
+        with open(image_path, "rb") as f:
+            data = f.read()
+    b64_img = base64.b64encode(data).decode()
+    mime = image_mime_type(image_path)
 
     prompt = """
 You are a professional eye specialist doctor.
@@ -78,66 +538,538 @@ Include:
 - Risk level
 """
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{b64_img}"
-                        }
+    content = openai_chat([
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime};base64,{b64_img}"
                     }
-                ]
-            }
-        ]
-    )
+                }
+            ]
+        }
+    ], user=user)
 
     return {
-        "model_response": response["choices"][0]["message"]["content"]
+        "model_response": content
     }
 
 
 
-def call_openai_chatbot(user_text):
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an eye specialist"},
-            {"role": "user", "content": user_text}
-        ]
-    )
-    return response["choices"][0]["message"]["content"]
+def _chatbot_messages(user_text):
+    return [
+        {"role": "system", "content": "You are an eye specialist"},
+        {"role": "user", "content": user_text}
+    ]
+
+@timed_stage("openai.chatbot")
+def call_openai_chatbot(user_text, user=None):
+    return openai_chat(_chatbot_messages(user_text), user=user)
+
+def stream_openai_chatbot(user_text, user=None):
+    """Yield the chatbot answer piece by piece as the model produces it."""
+    return openai_chat_stream(_chatbot_messages(user_text), user=user)
 
-def call_openai_vision_ai(score, total, weak_areas):
-    prompt = f"""
+VISION_AI_PROMPT = """
 Vision Test Report:
 Score: {score}/{total}
-Weak areas: {", ".join(weak_areas)}
+Weak areas: {weak_areas}
 Give risk analysis and advice in English & Tamil.
 """
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
+@timed_stage("openai.vision_ai")
+def call_openai_vision_ai(score, total, weak_areas, user=None):
+    prompt = VISION_AI_PROMPT.format(score=score, total=total, weak_areas=", ".join(weak_areas))
+    return openai_chat([{"role": "user", "content": prompt}], user=user)
+
+
+# -------------------- Vision report table --------------------
+# call_openai_vision_ai only depends on (score, total, weak areas), so its text
+# is stored per canonical input and reused. Keys carry VISION_REPORT_VERSION,
+# derived from the prompt, so editing the prompt invalidates old rows.
+# `python warm_vision_reports.py` fills the table ahead of time.
+VISION_REPORT_VERSION = hashlib.sha256((OPENAI_MODEL + VISION_AI_PROMPT).encode()).hexdigest()[:10]
+
+_vision_reports = {}
+_vision_reports_lock = threading.Lock()
+
+def vision_report_key(score, total, weak_areas):
+    areas = "+".join(sorted(set(weak_areas)))
+    return f"{VISION_REPORT_VERSION}|{int(score)}/{int(total)}|{areas}"
+
+def vision_ai_report(score, total, weak_areas, refresh=False, user=None):
+    key = vision_report_key(score, total, weak_areas)
+    if not refresh:
+        report = _vision_reports.get(key)
+        if report is not None:
+            return report
+        doc = vision_reports_col.find_one({"_id": key}, {"report": 1})
+        if doc:
+            with _vision_reports_lock:
+                _vision_reports[key] = doc["report"]
+            return doc["report"]
+
+    report = call_openai_vision_ai(score, total, sorted(set(weak_areas)), user=user)
+    vision_reports_col.replace_one(
+        {"_id": key},
+        {
+            "version": VISION_REPORT_VERSION,
+            "score": int(score),
+            "total": int(total),
+            "weak_areas": sorted(set(weak_areas)),
+            "report": report,
+            "created_at": datetime.utcnow()
+        },
+        upsert=True
     )
+    with _vision_reports_lock:
+        _vision_reports[key] = report
+    return report
+
+
+# -------------------- Chatbot cache --------------------
+# Answers keyed by the normalized question (case, whitespace and punctuation
+# folded). Per-process LRU with TTL; CHAT_CACHE_BACKEND=mongo also shares
+# entries via chat_cache. Fuzzy matching via difflib is opt-in
+# (CHAT_CACHE_FUZZY_CUTOFF > 0) and never bridges questions whose numbers or
+# negations differ ("2 year old" vs "12 year old", "is X not contagious").
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "1") != "0"
+CHAT_CACHE_BACKEND = os.getenv("CHAT_CACHE_BACKEND", "memory")
+CHAT_CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2000"))
+CHAT_CACHE_FUZZY_CUTOFF = float(os.getenv("CHAT_CACHE_FUZZY_CUTOFF", "0"))  # 0 disables fuzzy
+
+_chat_cache = OrderedDict()   # key -> (expires_at, answer)
+_chat_cache_lock = threading.Lock()
+chat_cache_stats = {"hits": 0, "fuzzy_hits": 0, "shared_hits": 0, "misses": 0}
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_DIGITS_RE = re.compile(r"\d+")
+_CONTRACTION_RE = re.compile(r"n t\b")
+_NEGATIONS = {"no", "not", "never", "without", "cannot", "cant", "dont", "doesnt", "isnt",
+              "arent", "wont", "shouldnt", "nor", "none", "neither"}
+
+def normalize_question(text):
+    text = _PUNCT_RE.sub(" ", (text or "").lower())
+    return " ".join(text.split())
+
+def _fuzzy_compatible(a, b):
+    """Near-identical text is only interchangeable if numbers and negations agree."""
+    if _DIGITS_RE.findall(a) != _DIGITS_RE.findall(b):
+        return False
+    return _negations(a) == _negations(b)
+
+def _negations(key):
+    # normalize_question turns "isn't" into "isn t"
+    return sorted(w for w in _CONTRACTION_RE.sub("nt", key).split() if w in _NEGATIONS)
+
+def _chat_cache_get_local(key):
+    now = datetime.utcnow()
+    with _chat_cache_lock:
+        entry = _chat_cache.get(key)
+        if entry is not None and entry[0] <= now:
+            del _chat_cache[key]
+            entry = None
+        if entry is not None:
+            _chat_cache.move_to_end(key)
+            return entry[1], "hits"
+        if CHAT_CACHE_FUZZY_CUTOFF <= 0:
+            return None, None
+        keys = list(_chat_cache.keys())
+
+    # O(entries) scan, done outside the lock
+    close = difflib.get_close_matches(key, keys, n=1, cutoff=CHAT_CACHE_FUZZY_CUTOFF)
+    if not close or not _fuzzy_compatible(key, close[0]):
+        return None, None
+    with _chat_cache_lock:
+        entry = _chat_cache.get(close[0])
+        if entry is None or entry[0] <= now:
+            return None, None
+        _chat_cache.move_to_end(close[0])
+        return entry[1], "fuzzy_hits"
+
+def _chat_cache_put_local(key, answer, expires_at):
+    with _chat_cache_lock:
+        _chat_cache[key] = (expires_at, answer)
+        _chat_cache.move_to_end(key)
+        while len(_chat_cache) > CHAT_CACHE_MAX_ENTRIES:
+            _chat_cache.popitem(last=False)
+
+def chat_cache_get(question):
+    if not CHAT_CACHE_ENABLED:
+        return None
+    key = normalize_question(question)
+    if not key:
+        return None
+
+    answer, kind = _chat_cache_get_local(key)
+    if answer is None and CHAT_CACHE_BACKEND == "mongo":
+        doc = chat_cache_col.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        if doc:
+            answer, kind = doc["answer"], "shared_hits"
+            _chat_cache_put_local(key, answer, doc["expires_at"])
+
+    chat_cache_stats[kind or "misses"] += 1
+    return answer
+
+def chat_cache_put(question, answer):
+    key = normalize_question(question)
+    if not CHAT_CACHE_ENABLED or not key or not answer:
+        return
+    expires_at = datetime.utcnow() + timedelta(seconds=CHAT_CACHE_TTL_SECONDS)
+    _chat_cache_put_local(key, answer, expires_at)
+    if CHAT_CACHE_BACKEND == "mongo":
+        chat_cache_col.replace_one(
+            {"_id": key},
+            {"answer": answer, "expires_at": expires_at},
+            upsert=True
+        )
 
-    return response["choices"][0]["message"]["content"]
+def chat_cache_hit_rate():
+    total = sum(chat_cache_stats.values())
+    hits = total - chat_cache_stats["misses"]
+    return dict(chat_cache_stats, entries=len(_chat_cache), hit_rate=(hits / total) if total else 0.0)
+
+def cached_chatbot_answer(user_text, user=None):
+    answer = chat_cache_get(user_text)
+    if answer is None:
+        answer = call_openai_chatbot(user_text, user=user)
+        chat_cache_put(user_text, answer)
+    return answer
+
+
+# -------------------- Analysis result cache --------------------
+# ai_result keyed by the sha256 of the uploaded bytes, so re-uploads of the same
+# photo reuse the stored report. Entries expire ANALYSIS_CACHE_TTL_DAYS after
+# their last use (TTL index) and the least recently used ones are trimmed once
+# the collection exceeds ANALYSIS_CACHE_MAX_ENTRIES.
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") != "0"
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+
+analysis_cache_stats = {"hits": 0, "misses": 0, "bypassed": 0}
+def get_cached_analysis(sha256, bypass=False, count_miss=True):
+    if bypass or not ANALYSIS_CACHE_ENABLED or not sha256:
+        analysis_cache_stats["bypassed"] += 1
+        return None
+    entry = analysis_cache_col.find_one_and_update(
+        {"_id": sha256},
+        {"$set": {"last_used_at": datetime.utcnow()}, "$inc": {"hits": 1}}
+    )
+    if entry is None:
+        if count_miss:
+            analysis_cache_stats["misses"] += 1
+        return None
+    analysis_cache_stats["hits"] += 1
+    return entry["ai_result"]
+
+def store_cached_analysis(sha256, ai_result):
+    if not ANALYSIS_CACHE_ENABLED or not sha256:
+        return
+    now = datetime.utcnow()
+    analysis_cache_col.update_one(
+        {"_id": sha256},
+        {"$set": {"ai_result": ai_result, "last_used_at": now},
+         "$setOnInsert": {"created_at": now, "hits": 0}},
+        upsert=True
+    )
+    overflow = analysis_cache_col.estimated_document_count() - ANALYSIS_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        stale = [d["_id"] for d in analysis_cache_col.find({}, {"_id": 1})
+                 .sort("last_used_at", 1).limit(overflow)]
+        analysis_cache_col.delete_many({"_id": {"$in": stale}})
+
+def analyze_image_cached(image_path, sha256=None, bypass=False, user=None, data=None):
+    # the upload route already counted the miss/bypass; re-check catches
+    # duplicates that finished while this one was queued
+    ai = None if bypass else get_cached_analysis(sha256, count_miss=False)
+    if ai is not None:
+        return ai
+    ai = call_openai_image_analysis_localfile(image_path, user=user, data=data)
+    store_cached_analysis(sha256, ai)
+    return ai
+
+
+# -------------------- Analysis jobs --------------------
+# Uploads insert the image doc as "pending" and queue a job in analysis_jobs;
+# a pool of background threads claims jobs from Mongo and writes ai_result back.
+# Jobs survive restarts: a "running" job whose lease expired is claimed again.
+# A failed attempt is requeued with retry_after pushed out exponentially
+# (ANALYSIS_RETRY_SECONDS, doubling per attempt); finished jobs expire
+# ANALYSIS_JOB_TTL_DAYS after finished_at.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_LEASE_SECONDS = int(os.getenv("ANALYSIS_LEASE_SECONDS", "300"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+ANALYSIS_RETRY_SECONDS = int(os.getenv("ANALYSIS_RETRY_SECONDS", "30"))
+ANALYSIS_POLL_SECONDS = 5
+
+_analysis_wakeup = threading.Event()
+_analysis_workers_lock = threading.Lock()
+_analysis_workers_pid = None
+
+def _analysis_job_doc(image_id, filepath, sha256=None, bypass_cache=False, username=None):
+    now = datetime.utcnow()
+    return {
+        "image_id": image_id,
+        "username": username,
+        "filepath": filepath,
+        "sha256": sha256,
+        "bypass_cache": bypass_cache,
+        "status": "queued",
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now
+    }
 
+def enqueue_analysis(image_id, filepath, sha256=None, bypass_cache=False, username=None):
+    analysis_jobs_col.insert_one(_analysis_job_doc(image_id, filepath, sha256, bypass_cache, username))
+    _analysis_wakeup.set()
 
-# ---- Quiz helpers ----
-def load_questions_from_excel(excel_path="static/games/vision_questions_40.xlsx"):
+def enqueue_analysis_many(jobs, claim=False):
     """
-    Returns list of question dicts with columns:
-    id (int), image (relative path under static/games/), option1..option4, answer
+    Queue several _analysis_job_doc()s with one insert_many. With claim=True
+    the jobs are inserted already leased to the caller, which runs them
+    itself; if it dies, the lease expires and the workers pick them up.
     """
-    if not os.path.exists(excel_path):
-        return []
+    if not jobs:
+        return jobs
+    if claim:
+        now = datetime.utcnow()
+        for job in jobs:
+            job.update({"status": "running", "locked_at": now, "attempts": 1})
+    analysis_jobs_col.insert_many(jobs)
+    if not claim:
+        _analysis_wakeup.set()
+    return jobs
+
+def analysis_status(doc):
+    # docs created before the job queue have no status but already carry ai_result
+    return doc.get("status") or ("done" if doc.get("ai_result") else "pending")
+
+def _claim_analysis_job():
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=ANALYSIS_LEASE_SECONDS)
+    return analysis_jobs_col.find_one_and_update(
+        _analysis_claim_filter(now, stale),
+        {"$set": {"status": "running", "locked_at": now, "updated_at": now},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def _run_analysis_job(job):
+    """Run one claimed job. Returns False if it was put back because OpenAI is unavailable."""
+    try:
+        original = recent_upload_bytes(job.get("sha256"))
+        try:
+            analysis_path, data = normalize_image_for_analysis(job["filepath"], original)
+            images_col.update_one({"_id": job["image_id"]}, {"$set": {"normalized_path": analysis_path}})
+        except (OSError, ValueError):
+            # unreadable by Pillow: send the original bytes
+            analysis_path, data = job["filepath"], original
+        ai = analyze_image_cached(analysis_path, job.get("sha256"), job.get("bypass_cache", False),
+                                  user=job.get("username"), data=data)
+    except OpenAIUnavailable as e:
+        # upstream degraded: put the job back without spending an attempt
+        now = datetime.utcnow()
+        analysis_jobs_col.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "queued", "error": str(e), "updated_at": now,
+                      "retry_after": now + timedelta(seconds=ANALYSIS_POLL_SECONDS)},
+             "$inc": {"attempts": -1}}
+        )
+        return False
+    except Exception as e:
+        attempts = job.get("attempts", 0)
+        give_up = attempts >= ANALYSIS_MAX_ATTEMPTS
+        now = datetime.utcnow()
+        if give_up:
+            update = {"status": "failed", "finished_at": now}
+        else:
+            backoff = ANALYSIS_RETRY_SECONDS * 2 ** max(attempts - 1, 0)
+            update = {"status": "queued", "retry_after": now + timedelta(seconds=backoff)}
+        update.update({"error": str(e), "updated_at": now})
+        analysis_jobs_col.update_one({"_id": job["_id"]}, {"$set": update})
+        if give_up:
+            images_col.update_one(
+                {"_id": job["image_id"]},
+                {"$set": {"status": "failed", "ai_error": str(e)}}
+            )
+            summary_update_scan(job.get("username"), job["image_id"], status="failed")
+        return True
+
+    now = datetime.utcnow()
+    images_col.update_one(
+        {"_id": job["image_id"]},
+        {"$set": {"ai_result": ai, "status": "done", "analyzed_at": now}}
+    )
+    summary_update_scan(job.get("username"), job["image_id"], status="done")
+    analysis_jobs_col.update_one(
+        {"_id": job["_id"]},
+        {"$set": {"status": "done", "finished_at": now, "updated_at": now}}
+    )
+    return True
+
+def _analysis_worker_loop():
+    while True:
+        try:
+            job = _claim_analysis_job()
+        except Exception:
+            job = None
+        if job is None:
+            _analysis_wakeup.wait(ANALYSIS_POLL_SECONDS)
+            _analysis_wakeup.clear()
+            continue
+        try:
+            ok = _run_analysis_job(job)
+        except Exception:
+            # e.g. Mongo dropped mid-write; the lease expires and the job is claimed again
+            app.logger.exception("analysis job %s failed", job.get("_id"))
+            ok = False
+        if not ok:
+            # upstream degraded: back off before claiming more
+            time.sleep(ANALYSIS_POLL_SECONDS)
+
+def start_analysis_workers(n=ANALYSIS_WORKERS):
+    """Start n daemon worker threads once per process (safe after gunicorn fork)."""
+    global _analysis_workers_pid
+    if n <= 0 or _analysis_workers_pid == os.getpid():
+        return
+    with _analysis_workers_lock:
+        if _analysis_workers_pid == os.getpid():
+            return
+        for i in range(n):
+            t = threading.Thread(target=_analysis_worker_loop, name=f"analysis-worker-{i}", daemon=True)
+            t.start()
+        _analysis_workers_pid = os.getpid()
+
+
+# -------------------- User summaries --------------------
+# One small doc per user (_id = username) holding what the patient dashboard
+# shows: scan count, newest scans, newest quiz scores and the profile fields.
+# Writers update it in place; a missing summary (older users) is rebuilt from
+# the source collections on first use.
+SUMMARY_LATEST_SCANS = int(os.getenv("SUMMARY_LATEST_SCANS", "12"))
+SUMMARY_LATEST_QUIZZES = int(os.getenv("SUMMARY_LATEST_QUIZZES", "10"))
+SUMMARY_PROFILE_FIELDS = ("full_name", "bp_systolic", "bp_diastolic")
+
+_SCAN_SUMMARY_FIELDS = {"filename": 1, "filepath": 1, "status": 1, "tech_validated": 1, "created_at": 1}
+
+def _scan_entry(doc):
+    return {
+        "_id": doc["_id"],
+        "filename": doc.get("filename"),
+        "filepath": doc.get("filepath"),
+        "status": analysis_status(doc),
+        "tech_validated": bool(doc.get("tech_validated")),
+        "created_at": doc.get("created_at"),
+    }
+
+def _quiz_entry(doc):
+    return {
+        "_id": doc["_id"],
+        "score": doc.get("score"),
+        "risk": doc.get("risk"),
+        "created_at": doc.get("created_at"),
+    }
+
+def _latest_scans(username):
+    cur = images_col.find({"username": username}, _SCAN_SUMMARY_FIELDS).sort("created_at", -1)
+    return [_scan_entry(d) for d in cur.limit(SUMMARY_LATEST_SCANS)]
+
+def rebuild_user_summary(username):
+    """Recompute a user's summary from images/vision_tests/profiles and store it."""
+    profile = profiles_col.find_one({"username": username}, dict.fromkeys(SUMMARY_PROFILE_FIELDS, 1)) or {}
+    quizzes = vision_col.find({"username": username, "score": {"$exists": True}},
+                              {"score": 1, "risk": 1, "created_at": 1}).sort("created_at", -1)
+    summary = {
+        "scan_count": images_col.count_documents({"username": username}),
+        "latest_scans": _latest_scans(username),
+        "quiz_count": vision_col.count_documents({"username": username, "score": {"$exists": True}}),
+        "latest_quizzes": [_quiz_entry(d) for d in quizzes.limit(SUMMARY_LATEST_QUIZZES)],
+        "profile": {k: profile[k] for k in SUMMARY_PROFILE_FIELDS if k in profile} or None,
+        "updated_at": datetime.utcnow(),
+    }
+    user_summaries_col.replace_one({"_id": username}, summary, upsert=True)
+    summary["_id"] = username
+    return summary
+
+def get_user_summary(username):
+    return user_summaries_col.find_one({"_id": username}) or rebuild_user_summary(username)
+
+def _update_user_summary(username, update, filter_extra=None):
+    if not username:
+        return
+    update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+    res = user_summaries_col.update_one(dict({"_id": username}, **(filter_extra or {})), update)
+    if res.matched_count == 0 and not filter_extra:
+        # first write for a user without a summary: the rebuild already sees the change
+        rebuild_user_summary(username)
+
+def summary_add_scans(username, docs):
+    _update_user_summary(username, {
+        "$inc": {"scan_count": len(docs)},
+        "$push": {"latest_scans": {
+            "$each": [_scan_entry(d) for d in docs],
+            "$sort": {"created_at": -1},
+            "$slice": SUMMARY_LATEST_SCANS,
+        }},
+    })
+
+def summary_update_scan(username, image_id, **fields):
+    """Set fields on one of the user's latest_scans entries (no-op if it dropped off)."""
+    _update_user_summary(
+        username,
+        {"$set": {f"latest_scans.$.{k}": v for k, v in fields.items()}},
+        filter_extra={"latest_scans._id": image_id}
+    )
+
+def summary_remove_scan(username):
+    # re-reading the newest scans also backfills the slot the deleted one leaves
+    _update_user_summary(username, {
+        "$inc": {"scan_count": -1},
+        "$set": {"latest_scans": _latest_scans(username)},
+    })
+
+def summary_add_quiz(username, doc):
+    _update_user_summary(username, {
+        "$inc": {"quiz_count": 1},
+        "$push": {"latest_quizzes": {
+            "$each": [_quiz_entry(doc)],
+            "$sort": {"created_at": -1},
+            "$slice": SUMMARY_LATEST_QUIZZES,
+        }},
+    })
+
+def summary_set_profile(username, profile):
+    _update_user_summary(username, {"$set": {
+        "profile": {k: profile[k] for k in SUMMARY_PROFILE_FIELDS if k in profile}
+    }})
+
+
+# ---- Quiz helpers ----
+QUIZ_SIZE = 7
+QUESTION_EXCEL = "static/games/vision_questions_40.xlsx"
+
+# Process-wide question bank: the workbook is parsed once and re-parsed only
+# when its mtime changes AND its content hash differs from the cached one.
+# The bank is an immutable snapshot (path, mtime, sha256, records, by_id)
+# replaced by a single assignment, so lock-free readers never see a mix of
+# two loads.
+_question_bank_lock = threading.Lock()
+_question_bank = (None, None, None, (), MappingProxyType({}))
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+@timed_stage("questions.parse_excel")
+def _parse_questions_excel(excel_path):
     df = pd.read_excel(excel_path, engine="openpyxl")
     # ensure consistent columns
     df = df.fillna('')
@@ -152,8 +1084,274 @@ def load_questions_from_excel(excel_path="static/games/vision_questions_40.xlsx"
             q["image"] = ""
     return questions
 
+def get_question_bank(excel_path=QUESTION_EXCEL):
+    """
+    Returns (records, by_id) for the question workbook.
+    records is a tuple of read-only question mappings (id, image relative to
+    static/games/, option1..option4, answer), by_id maps int id -> record.
+    The workbook is only re-read when its mtime changes and its sha256 differs.
+    """
+    try:
+        mtime = os.stat(excel_path).st_mtime_ns
+    except OSError:
+        return (), MappingProxyType({})
+
+    global _question_bank
+    path, bank_mtime, _, records, by_id = _question_bank
+    if path == excel_path and bank_mtime == mtime:
+        return records, by_id
+
+    with _question_bank_lock:
+        path, bank_mtime, bank_sha, records, by_id = _question_bank
+        if path == excel_path and bank_mtime == mtime:
+            return records, by_id
+
+        sha = _file_sha256(excel_path)
+        if path != excel_path or bank_sha != sha:
+            records = tuple(MappingProxyType(q) for q in _parse_questions_excel(excel_path))
+            by_id = MappingProxyType({int(q["id"]): q for q in records if q.get("id") != ""})
+        # else touched but unchanged: keep the parsed records under the new mtime
+        _question_bank = (excel_path, mtime, sha, records, by_id)
+        return records, by_id
+
+
+# ---- Fingerprinted question images ----
+GAMES_FOLDER = os.path.join("static", "games")
+GAMES_ASSET_MAX_AGE = 365 * 24 * 3600
+_asset_digests = {}   # relative path -> (mtime_ns, digest)
+
+def asset_digest(rel_path):
+    path = safe_join(GAMES_FOLDER, rel_path)
+    if path is None:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _asset_digests.get(rel_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    digest = _file_sha256(path)[:12]
+    _asset_digests[rel_path] = (mtime, digest)
+    return digest
+
+def question_image_url(rel_path):
+    """URL for a question image that changes whenever the file content does."""
+    digest = asset_digest(rel_path) if rel_path else None
+    if not digest:
+        return url_for("static", filename="games/" + rel_path)
+    return url_for("game_asset", digest=digest, filename=rel_path)
+
+# ---- On-demand question images ----
+# QUIZ_QUESTION_SOURCE=procedural draws each quiz question as a
+# (category, seed) pair with id "<category>-<seed>" instead of sampling the
+# Excel bank. Seeds come from a fixed pool of PROCEDURAL_SEEDS_PER_CATEGORY per
+# category, and ids outside it are rejected, so at most
+# categories x pool images exist. Each is rendered by
+# generate_vision_questions.py's drawing code on first request, then served
+# from a bounded in-memory LRU backed by a disk cache keyed by the spec hash.
+QUIZ_QUESTION_SOURCE = os.getenv("QUIZ_QUESTION_SOURCE", "excel")   # excel | procedural
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "256"))
+RENDER_MAX_CONCURRENCY = int(os.getenv("RENDER_MAX_CONCURRENCY", "2"))
+PROCEDURAL_SEEDS_PER_CATEGORY = int(os.getenv("PROCEDURAL_SEEDS_PER_CATEGORY", "500"))
+RENDERED_FOLDER = os.getenv("RENDERED_FOLDER", os.path.join(GAMES_FOLDER, "rendered"))
+PROCEDURAL_CATEGORIES = tuple(question_gen.RANDOM_SPEC_MAKERS)
+_PROCEDURAL_ID_RE = re.compile(r"^([a-z_]+)-(\d{1,10})$")
+
+_render_cache = OrderedDict()   # spec hash -> png bytes
+_render_cache_lock = threading.Lock()
+_render_slots = threading.BoundedSemaphore(RENDER_MAX_CONCURRENCY)
+render_cache_stats = {"memory_hits": 0, "disk_hits": 0, "renders": 0}
+
+def procedural_spec(qid):
+    """Spec for an on-demand question id, or None if the id is not one."""
+    m = _PROCEDURAL_ID_RE.match(str(qid))
+    if not m or m.group(1) not in PROCEDURAL_CATEGORIES:
+        return None
+    seed = int(m.group(2))
+    if seed >= PROCEDURAL_SEEDS_PER_CATEGORY:
+        return None
+    return question_gen.procedural_spec(m.group(1), seed)
+
+def procedural_question(qid):
+    spec = procedural_spec(qid)
+    if spec is None:
+        return None
+    return MappingProxyType(dict(question_gen.question_record(spec), procedural=True))
+
+def new_procedural_ids(count):
+    return [f"{random.choice(PROCEDURAL_CATEGORIES)}-{random.randrange(PROCEDURAL_SEEDS_PER_CATEGORY)}"
+            for _ in range(count)]
+
+def _render_cache_put(key, png):
+    with _render_cache_lock:
+        _render_cache[key] = png
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > RENDER_CACHE_MAX_ENTRIES:
+            _render_cache.popitem(last=False)
+
+def rendered_question_png(spec):
+    """(spec hash, png bytes) for a spec: memory LRU, then disk, then a bounded render."""
+    key = question_gen.spec_hash(spec)
+    with _render_cache_lock:
+        png = _render_cache.get(key)
+        if png is not None:
+            _render_cache.move_to_end(key)
+            render_cache_stats["memory_hits"] += 1
+            return key, png
+
+    path = os.path.join(RENDERED_FOLDER, key[:2], key + ".png")
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+        render_cache_stats["disk_hits"] += 1
+    except OSError:
+        with _render_slots:
+            with stage("questions.render"):
+                png = run_cpu_bound(question_gen.render_png, spec)
+        render_cache_stats["renders"] += 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(png)
+        os.replace(tmp, path)
+
+    _render_cache_put(key, png)
+    return key, png
+
+def question_image(q):
+    """Image URL for a question record from either source."""
+    if q.get("procedural"):
+        return url_for("vision_quiz_image", qid=q["id"], v=question_gen.RENDER_VERSION)
+    return question_image_url(q.get("image", ""))
+
+# ---- Quiz state store ----
+# The session cookie only carries a quiz id; the state (question ids, answers,
+# current index) lives server-side. "memory" is a per-process LRU with TTL;
+# set QUIZ_STATE_BACKEND=mongo when running several workers.
+QUIZ_STATE_BACKEND = os.getenv("QUIZ_STATE_BACKEND", "memory")
+QUIZ_STATE_TTL_SECONDS = int(os.getenv("QUIZ_STATE_TTL_SECONDS", str(2 * 3600)))
+QUIZ_STATE_MAX_ENTRIES = int(os.getenv("QUIZ_STATE_MAX_ENTRIES", "10000"))
+
+_quiz_states = OrderedDict()   # quiz_id -> (expires_at, state)
+_quiz_states_lock = threading.Lock()
+
+def quiz_state_save(quiz_id, state):
+    expires_at = datetime.utcnow() + timedelta(seconds=QUIZ_STATE_TTL_SECONDS)
+    if QUIZ_STATE_BACKEND == "mongo":
+        quiz_states_col.replace_one(
+            {"_id": quiz_id},
+            {"state": state, "expires_at": expires_at},
+            upsert=True
+        )
+        return
+    with _quiz_states_lock:
+        _quiz_states[quiz_id] = (expires_at, state)
+        _quiz_states.move_to_end(quiz_id)
+        while len(_quiz_states) > QUIZ_STATE_MAX_ENTRIES:
+            _quiz_states.popitem(last=False)
+
+def quiz_state_load(quiz_id):
+    if not quiz_id:
+        return None
+    now = datetime.utcnow()
+    if QUIZ_STATE_BACKEND == "mongo":
+        doc = quiz_states_col.find_one({"_id": quiz_id, "expires_at": {"$gt": now}})
+        return doc["state"] if doc else None
+    with _quiz_states_lock:
+        entry = _quiz_states.get(quiz_id)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del _quiz_states[quiz_id]
+            return None
+        _quiz_states.move_to_end(quiz_id)
+        return entry[1]
+
+def quiz_state_delete(quiz_id):
+    if QUIZ_STATE_BACKEND == "mongo":
+        quiz_states_col.delete_one({"_id": quiz_id})
+        return
+    with _quiz_states_lock:
+        _quiz_states.pop(quiz_id, None)
+
+def active_quiz():
+    """Return (quiz_id, state) for the logged-in user's running quiz, or (None, None)."""
+    quiz_id = session.get("vision_quiz_id")
+    state = quiz_state_load(quiz_id)
+    if not state or state.get("username") != session.get("username"):
+        return None, None
+    return quiz_id, state
+
+def quiz_questions(state):
+    _, by_id = get_question_bank()
+    questions = []
+    for qid in state["question_ids"]:
+        q = by_id.get(qid) if isinstance(qid, int) else procedural_question(qid)
+        questions.append(q or MappingProxyType({"id": qid}))
+    return questions
+
+
+# -------------------- Metrics --------------------
+# Request timing middleware; per-stage timers live in metrics.py and on the
+# helpers above. SLOW_REQUEST_MS > 0 logs slower requests with their stages.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@app.before_request
+def _start_request_timer():
+    begin_request()
+
+@app.after_request
+def _record_request_timing(resp):
+    elapsed, stages = end_request()
+    endpoint = request.endpoint or "unknown"
+    observe("eye_request_duration_seconds", elapsed, "Request latency",
+            endpoint=endpoint, method=request.method, status=resp.status_code)
+    inc("eye_requests_total", help_text="Requests served",
+        endpoint=endpoint, method=request.method, status=resp.status_code)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in sorted(stages.items(), key=lambda kv: -kv[1]))
+        app.logger.warning("slow request %s %s %.0fms [%s]", request.method, request.path, elapsed * 1000, breakdown)
+    return resp
+
+def _template_started(sender, template, context, **extra):
+    g._template_started = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    started = g.pop("_template_started", None)
+    if started is not None:
+        record_stage(f"template.{template.name}", time.perf_counter() - started)
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_finished, app)
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    gauges = {
+        "eye_openai_breaker_open": 0 if openai_breaker_state() == "closed" else 1,
+        "eye_pdf_cache_bytes": _pdf_cache_bytes,
+        "eye_quiz_states_in_memory": len(_quiz_states),
+        "eye_question_render_cache_entries": len(_render_cache),
+    }
+    for k, v in render_cache_stats.items():
+        gauges[f"eye_question_render_{k}"] = v
+    for k, v in vision_analytics.cache_info().items():
+        gauges[f"eye_analytics_cache_{k}"] = v
+    for k, v in analysis_cache_stats.items():
+        gauges[f"eye_analysis_cache_{k}"] = v
+    for k, v in chat_cache_hit_rate().items():
+        gauges[f"eye_chat_cache_{k}"] = v
+    return Response(render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
 
 # -------------------- Routes --------------------
+@app.before_request
+def _ensure_background_setup():
+    ensure_indexes_once()
+    start_analysis_workers()
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -228,6 +1426,7 @@ def edit_profile():
             {"$set": data},
             upsert=True
         )
+        summary_set_profile(user, data)
 
         flash("Profile saved successfully ✅")
         return redirect("/patient")
@@ -248,15 +1447,15 @@ def patient_dashboard():
         return redirect("/login")
 
     user = session["username"]
-
-    docs = list(images_col.find({"username": user}).sort("created_at",-1))
-    profile = profiles_col.find_one({"username": user})
+    summary = get_user_summary(user)
 
     return render_template(
         "patient_dashboard.html",
-        images=docs,
+        images=summary.get("latest_scans", []),
+        scan_count=summary.get("scan_count", 0),
+        quizzes=summary.get("latest_quizzes", []),
         username=user,
-        profile=profile
+        profile=summary.get("profile")
     )
 
 @app.route("/upload", methods=["GET","POST"])
@@ -274,23 +1473,48 @@ def upload():
             flash("Invalid file")
             return redirect(request.url)
 
-        path, fname = save_file_storage(file)
-        ai = call_openai_image_analysis_localfile(path)
+        path, fname, sha256, _ = save_file_storage(file)
+        bypass = wants_cache_bypass(request)
+        cached = get_cached_analysis(sha256, bypass)
 
         doc = {
             "username": session["username"],
             "filename": fname,
             "filepath": path,
-            "ai_result": ai,
+            "sha256": sha256,
+            "ai_result": cached,
+            "status": "done" if cached else "pending",
             "tech_validated": False,
             "created_at": datetime.utcnow()
         }
 
         res = images_col.insert_one(doc)
+        summary_add_scans(session["username"], [doc])
+        if not cached:
+            enqueue_analysis(res.inserted_id, path, sha256, bypass, session["username"])
         return redirect(url_for("view_report", image_id=str(res.inserted_id)))
 
     return render_template("upload_image.html")
 
+@app.route("/thumb/<size>/<path:filename>")
+def thumbnail(size, filename):
+    if 'username' not in session:
+        return jsonify({"error": "login_required"}), 401
+    if size not in THUMB_SIZES:
+        return jsonify({"error": "bad_size"}), 404
+    try:
+        path = thumbnail_path(filename, size)
+    except (OSError, ValueError):
+        path = None
+    if not path:
+        return jsonify({"error": "not_found"}), 404
+    resp = send_file(path, mimetype="image/jpeg", max_age=THUMB_MAX_AGE, conditional=True)
+    resp.cache_control.immutable = True
+    # behind a login now: browsers may cache it, shared proxies may not
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
+
 @app.route("/delete_scan/<scan_id>", methods=["POST"])
 def delete_scan(scan_id):
     if 'username' not in session:
@@ -303,10 +1527,19 @@ def delete_scan(scan_id):
     # Security check – user can delete only their own scans
     if scan and scan["username"] == session["username"]:
         images_col.delete_one({"_id": ObjectId(scan_id)})
+        summary_remove_scan(scan["username"])
 
     return redirect("/patient")
 
 
+def save_chat(username, question, answer):
+    chats_col.insert_one({
+        "username": username,
+        "question": question,
+        "answer": answer,
+        "created_at": datetime.utcnow()
+    })
+
 @app.route("/chatbot", methods=["GET","POST"])
 def chatbot():
     if "username" not in session:
@@ -315,10 +1548,117 @@ def chatbot():
     answer = None
     if request.method == "POST":
         q = request.form.get("question")
-        answer = call_openai_chatbot(q)
+        try:
+            answer = cached_chatbot_answer(q, user=session["username"])
+        except (OpenAIUnavailable, openai.error.OpenAIError):
+            return render_template("chatbot.html", answer=None,
+                                   error="The AI assistant is busy right now. Please try again in a minute.")
+        save_chat(session["username"], q, answer)
 
     return render_template("chatbot.html", answer=answer)
 
+def _sse(data, event=None):
+    msg = f"event: {event}\n" if event else ""
+    return msg + f"data: {json.dumps(data)}\n\n"
+
+# Server-Sent Events: the question is POSTed to /chatbot/stream, which keeps
+# it server-side under a one-shot stream id (so it never lands in a URL or an
+# access log), and the EventSource opens /chatbot/stream/<id>. Tokens are
+# forwarded as they arrive, the full answer is saved once the stream
+# completes. /chatbot (POST) stays as the fallback.
+# Pending streams have their own small store; like quiz state it must be in
+# Mongo when several workers serve the POST and the GET, so it follows
+# QUIZ_STATE_BACKEND unless CHAT_STREAM_BACKEND says otherwise.
+CHAT_STREAM_BACKEND = os.getenv("CHAT_STREAM_BACKEND", QUIZ_STATE_BACKEND)
+CHAT_STREAM_TTL_SECONDS = int(os.getenv("CHAT_STREAM_TTL_SECONDS", "60"))
+CHAT_STREAM_MAX_ENTRIES = int(os.getenv("CHAT_STREAM_MAX_ENTRIES", "1000"))
+
+_chat_streams = OrderedDict()   # stream_id -> (expires_at, username, question)
+_chat_streams_lock = threading.Lock()
+
+def chat_stream_put(username, question):
+    stream_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=CHAT_STREAM_TTL_SECONDS)
+    if CHAT_STREAM_BACKEND == "mongo":
+        chat_streams_col.insert_one({"_id": stream_id, "username": username,
+                                     "question": question, "expires_at": expires_at})
+        return stream_id
+    with _chat_streams_lock:
+        # one ttl for every entry, so the oldest are at the front
+        while _chat_streams and next(iter(_chat_streams.values()))[0] <= now:
+            _chat_streams.popitem(last=False)
+        _chat_streams[stream_id] = (expires_at, username, question)
+        while len(_chat_streams) > CHAT_STREAM_MAX_ENTRIES:
+            _chat_streams.popitem(last=False)
+    return stream_id
+
+def chat_stream_pop(stream_id, username):
+    """The pending question for username's stream_id, removed so it is used once; None if unknown."""
+    now = datetime.utcnow()
+    if CHAT_STREAM_BACKEND == "mongo":
+        doc = chat_streams_col.find_one_and_delete(
+            {"_id": stream_id, "username": username, "expires_at": {"$gt": now}})
+        return doc["question"] if doc else None
+    with _chat_streams_lock:
+        entry = _chat_streams.get(stream_id)
+        if entry is None or entry[1] != username:
+            return None
+        del _chat_streams[stream_id]
+        return entry[2] if entry[0] > now else None
+
+@app.route("/chatbot/stream", methods=["POST"])
+def chatbot_stream_start():
+    if "username" not in session:
+        return jsonify({"error": "login_required"}), 401
+    data = request.get_json(silent=True) or request.form
+    q = (data.get("question") or "").strip()
+    if not q:
+        return jsonify({"error": "empty_question"}), 400
+    stream_id = chat_stream_put(session["username"], q)
+    return jsonify({"stream_id": stream_id, "url": url_for("chatbot_stream", stream_id=stream_id)})
+
+@app.route("/chatbot/stream/<stream_id>")
+def chatbot_stream(stream_id):
+    if "username" not in session:
+        return jsonify({"error": "login_required"}), 401
+    username = session["username"]
+    # one-shot: an EventSource reconnect must not ask (and save) again
+    q = chat_stream_pop(stream_id, username)
+    if q is None:
+        return jsonify({"error": "unknown_stream"}), 404
+
+    def generate():
+        cached = chat_cache_get(q)
+        if cached is not None:
+            save_chat(username, q, cached)
+            yield _sse({"token": cached})
+            yield _sse({"answer": cached}, event="done")
+            return
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            for token in stream_openai_chatbot(q, user=username):
+                if not parts:
+                    observe("eye_chat_first_token_seconds", time.perf_counter() - started,
+                            "Time to first streamed chatbot token")
+                parts.append(token)
+                yield _sse({"token": token})
+        except Exception as e:
+            yield _sse({"error": str(e)}, event="error")
+            return
+        answer = "".join(parts)
+        chat_cache_put(q, answer)
+        save_chat(username, q, answer)
+        yield _sse({"answer": answer}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/vision_test", methods=["GET","POST"])
 def vision_test():
     if "username" not in session:
@@ -388,202 +1728,165 @@ def vision_quiz_start():
     if 'username' not in session:
         return redirect(url_for("login"))
 
-    all_qs = load_questions_from_excel()
-    if len(all_qs) < 7:
-        flash("Not enough questions available. Seed Excel first.", "danger")
-        return redirect(url_for("patient_dashboard"))
-
-    chosen = random.sample(all_qs, 7)
-    # save only minimal required fields to session
-    session['vision_quiz'] = {
-        "questions": chosen,   # list of dicts
+    if QUIZ_QUESTION_SOURCE == "procedural":
+        question_ids = new_procedural_ids(QUIZ_SIZE)
+    else:
+        all_qs, _ = get_question_bank()
+        if len(all_qs) < QUIZ_SIZE:
+            flash("Not enough questions available. Seed Excel first.", "danger")
+            return redirect(url_for("patient_dashboard"))
+        question_ids = [int(q["id"]) for q in random.sample(all_qs, QUIZ_SIZE)]
+
+    quiz_id = uuid.uuid4().hex
+    quiz_state_save(quiz_id, {
+        "username": session["username"],
+        "question_ids": question_ids,
         "answers": {},         # idx -> user's answer
         "current": 0,
         "started_at": datetime.utcnow().isoformat()
-    }
-    session.modified = True
+    })
+    old_id = session.get("vision_quiz_id")
+    if old_id:
+        quiz_state_delete(old_id)
+    session["vision_quiz_id"] = quiz_id
     return redirect(url_for("vision_quiz"))
 
 @app.route("/vision_quiz")
 def vision_quiz():
-    if 'username' not in session or 'vision_quiz' not in session:
+    if 'username' not in session:
+        return redirect(url_for("patient_dashboard"))
+    _, quiz = active_quiz()
+    if not quiz:
         return redirect(url_for("patient_dashboard"))
 
-    quiz = session['vision_quiz']
+    payloads = _quiz_payloads(quiz)
     current = quiz.get("current", 0)
-    total = len(quiz["questions"])
-    q = quiz["questions"][current]
-    # build full static path for image URL in template: url_for('static', filename='games/' + q['image'])
-    return render_template("vision_quiz.html", q=q, index=current+1, total=total)
+    return render_template(
+        "vision_quiz.html",
+        q=payloads[current],
+        questions=payloads,
+        index=current+1,
+        total=len(payloads)
+    )
+
+def _question_payload(idx, q, selected=""):
+    # minimal safe payload (do not expose answer)
+    return {
+        "index": idx,
+        "prompt": q.get("prompt",""),
+        "image": question_image(q),
+        "options": [q.get("option1",""), q.get("option2",""), q.get("option3",""), q.get("option4","")],
+        "type": q.get("type","single"),
+        "selected": selected
+    }
+
+def _quiz_payloads(quiz):
+    answers = quiz.get("answers", {})
+    return [_question_payload(i, q, answers.get(str(i), "")) for i, q in enumerate(quiz_questions(quiz))]
+
+# Question images under a content digest, cacheable forever
+@app.route("/games/<digest>/<path:filename>")
+def game_asset(digest, filename):
+    if asset_digest(filename) != digest:
+        return jsonify({"error": "not_found"}), 404
+    resp = send_file(safe_join(GAMES_FOLDER, filename), max_age=GAMES_ASSET_MAX_AGE, conditional=True)
+    resp.cache_control.immutable = True
+    resp.cache_control.public = True
+    return resp
+
+# On-demand question image; the URL carries RENDER_VERSION so it is cacheable forever
+@app.route("/vision_quiz/image/<qid>")
+def vision_quiz_image(qid):
+    if 'username' not in session:
+        return jsonify({"error": "login_required"}), 401
+    spec = procedural_spec(qid)
+    if spec is None:
+        return jsonify({"error": "not_found"}), 404
+    etag, png = rendered_question_png(spec)
+    resp = send_file(io.BytesIO(png), mimetype="image/png", etag=etag,
+                     max_age=GAMES_ASSET_MAX_AGE, conditional=True)
+    resp.cache_control.immutable = True
+    return resp
 
 # API to fetch specific question by index (used by frontend when navigating)
 @app.route("/vision_quiz/api/question/<int:idx>")
 def vision_quiz_api_question(idx):
-    if 'vision_quiz' not in session:
+    _, quiz = active_quiz()
+    if not quiz:
         return jsonify({"error":"not_started"}), 400
-    quiz = session['vision_quiz']
-    if idx < 0 or idx >= len(quiz["questions"]):
+    if idx < 0 or idx >= len(quiz["question_ids"]):
         return jsonify({"error":"out_of_range"}), 400
-    q = quiz["questions"][idx]
-    # return minimal safe payload (do not expose answer)
-    payload = {
-        "index": idx,
-        "prompt": q.get("prompt",""),
-        "image": url_for("static", filename="games/" + q.get("image","")),
-        "options": [q.get("option1",""), q.get("option2",""), q.get("option3",""), q.get("option4","")],
-        "type": q.get("type","single")
-    }
-    return jsonify(payload)
+    q = quiz_questions(quiz)[idx]
+    return jsonify(_question_payload(idx, q, quiz.get("answers", {}).get(str(idx), "")))
+
+# API to fetch every question of the active quiz in one round trip
+@app.route("/vision_quiz/api/questions")
+def vision_quiz_api_questions():
+    _, quiz = active_quiz()
+    if not quiz:
+        return jsonify({"error":"not_started"}), 400
+    return jsonify({
+        "current": quiz.get("current", 0),
+        "total": len(quiz["question_ids"]),
+        "questions": _quiz_payloads(quiz)
+    })
 
 # API to submit/save answer (ajax)
 @app.route("/vision_quiz/api/answer", methods=["POST"])
 def vision_quiz_api_answer():
-    if 'vision_quiz' not in session:
+    quiz_id, quiz = active_quiz()
+    if not quiz:
         return jsonify({"error":"not_started"}), 400
-    data = request.get_json() or request.form
-    idx = int(data.get("index", session['vision_quiz'].get("current", 0)))
+    data = request.get_json(silent=True) or request.form
+    idx = int(data.get("index", quiz.get("current", 0)))
     ans = data.get("answer","").strip()
     # store
-    session['vision_quiz']['answers'][str(idx)] = ans
+    quiz["answers"][str(idx)] = ans
     # optionally advance
     if data.get("advance") in [True, "true", "True", "1"]:
-        session['vision_quiz']['current'] = min(idx+1, len(session['vision_quiz']['questions'])-1)
-    session.modified = True
+        quiz["current"] = min(idx+1, len(quiz["question_ids"])-1)
+    quiz_state_save(quiz_id, quiz)
     return jsonify({"ok": True})
 
 # Finish and score
-import difflib
+_scoring_index = {"records": None, "index": {}}
 
-def _normalize_ans(a):
-    if a is None:
-        return ""
-    s = str(a).strip()
-    # remove repeated whitespace
-    s = " ".join(s.split())
-    # normalize common punctuation
-    s = s.replace("–", "-").replace("—", "-")
-    return s.lower()
-
-def _numeric_equal(a, b):
-    # return True if both are numeric and equal as ints
-    try:
-        ai = int(float(a))
-        bi = int(float(b))
-        return ai == bi
-    except Exception:
-        return False
+def scoring_index():
+    """Per-question category/answer index, rebuilt only when the question bank reloads."""
+    records, _ = get_question_bank()
+    if _scoring_index["records"] is not records:
+        _scoring_index["index"] = build_question_index(records)
+        _scoring_index["records"] = records
+    return _scoring_index["index"]
 
 @app.route("/vision_quiz/finish", methods=["POST"])
 def vision_quiz_finish():
-    if 'vision_quiz' not in session:
-        return redirect(url_for("patient_dashboard"))
-
-    quiz = session.pop('vision_quiz', None)
+    quiz_id, quiz = active_quiz()
     if not quiz:
         return redirect(url_for("patient_dashboard"))
+    quiz_state_delete(quiz_id)
+    session.pop("vision_quiz_id", None)
 
-    questions = quiz["questions"]
-    answers = quiz.get("answers", {})
-
-    correct_count = 0
-    breakdown = []
-
-    for i, q in enumerate(questions):
-        correct_raw = q.get("answer", "")
-        user_raw = answers.get(str(i), "")  # answers stored as strings keyed by index
-
-        correct = _normalize_ans(correct_raw)
-        user = _normalize_ans(user_raw)
-
-        # First try exact normalized match
-        ok = False
-        reason = ""
-
-        if correct == user and correct != "":
-            ok = True
-            reason = "exact match"
-        else:
-            # numeric flexibility: 6 == 06 == "6.0"
-            if _numeric_equal(correct, user):
-                ok = True
-                reason = "numeric match"
-            else:
-                # try fuzzy (close match) but only if both are reasonably short text (avoid matching long texts)
-                # use a conservative cutoff so we don't accidentally mark wrong answers correct
-                try:
-                    if len(correct) <= 40 and len(user) <= 40 and correct and user:
-                        seq = difflib.SequenceMatcher(None, correct, user)
-                        ratio = seq.ratio()
-                        if ratio >= 0.78:
-                            ok = True
-                            reason = f"fuzzy match (ratio={ratio:.2f})"
-                        else:
-                            reason = f"no match (ratio={ratio:.2f})"
-                    else:
-                        reason = "no match (length or empty)"
-                except Exception as e:
-                    reason = f"error in fuzzy matching: {e}"
-
-        if ok:
-            correct_count += 1
-
-        # Build breakdown entry (include raw values so you can debug)
-        breakdown.append({
-            "index": i,
-            "image": url_for("static", filename="games/" + q.get("image","")),
-            "prompt": q.get("prompt",""),
-            "correct_raw": correct_raw,
-            "user_raw": user_raw,
-            "correct_norm": correct,
-            "user_norm": user,
-            "ok": ok,
-            "reason": reason
-        })
-
-    # Score as percentage
-       # Score as percentage
-    score_pct = int(round((correct_count / max(1, len(questions))) * 100))
-
-    total_q = len(questions)
+    questions = quiz_questions(quiz)
+    result = score_quiz(questions, quiz.get("answers", {}), scoring_index())
+    breakdown = result["breakdown"]
+    for b, q in zip(breakdown, questions):
+        b["image"] = question_image(q)
 
-    # Risk label
-    if correct_count <= total_q * 0.4:
-        risk_label = "High"
-    elif correct_count <= total_q * 0.7:
-        risk_label = "Moderate"
-    else:
-        risk_label = "Low"
-
-    # Weak area detection
-    weak_areas = []
-    for b in breakdown:
-        if not b["ok"]:
-            text = (b.get("prompt") or "").lower()
-            if "contrast" in text:
-                weak_areas.append("Contrast Sensitivity")
-            if "moving" in text or "tracking" in text:
-                weak_areas.append("Visual Tracking")
-            if "color" in text:
-                weak_areas.append("Color Sensitivity")
-
-    if not weak_areas:
-        weak_areas = ["General visual fatigue"]
+    score_pct = result["score"]
+    risk_label = result["risk"]
+    insights = result["insights"]
 
     # AI professional analysis
-    ai_report = call_openai_vision_ai(
-        score=correct_count,
-        total=total_q,
-        weak_areas=list(set(weak_areas))
-    )
-
-    insights = []
-    if risk_label == "Low":
-        insights.append("Overall vision appears healthy.")
-    elif risk_label == "Moderate":
-        insights.append("Mild visual stress detected. Monitor eye habits.")
-    else:
-        insights.append("High visual strain detected. Professional consultation advised.")
-
+    try:
+        ai_report = vision_ai_report(
+            score=result["correct"],
+            total=result["total"],
+            weak_areas=result["weak_areas"],
+            user=session.get("username")
+        )
+    except (OpenAIUnavailable, openai.error.OpenAIError):
+        ai_report = "AI analysis is temporarily unavailable. Your score has been saved."
 
     # Save result to DB (store breakdown for future audit)
     result_doc = {
@@ -593,10 +1896,14 @@ def vision_quiz_finish():
         "ai_report": ai_report,
         "breakdown": breakdown,
         "insights": insights,
+        "weak_areas": result["weak_areas"],
+        "scoring_version": result["scoring_version"],
         "created_at": datetime.utcnow()
     }
 
     vision_col.insert_one(result_doc)
+    summary_add_quiz(result_doc["username"], result_doc)
+    vision_analytics.invalidate_user(result_doc["username"])
 
 
     # Render result page (template unchanged)
@@ -612,21 +1919,37 @@ def vision_quiz_finish():
 
 
 
+# ---- Vision analytics (aggregation pipelines, see vision_analytics.py) ----
+ANALYTICS_USER_BUCKET_SECONDS = int(os.getenv("ANALYTICS_USER_BUCKET_SECONDS", "300"))
+ANALYTICS_POPULATION_BUCKET_SECONDS = int(os.getenv("ANALYTICS_POPULATION_BUCKET_SECONDS", "900"))
+ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", "90"))
+
+def population_analytics():
+    return vision_analytics.population_summary(
+        vision_col, ANALYTICS_WINDOW_DAYS, ANALYTICS_POPULATION_BUCKET_SECONDS)
+
 @app.route("/vision_history")
 def vision_history():
     if 'username' not in session:
         return redirect(url_for("login"))
-    docs = list(vision_col.find({"username": session['username']}).sort("created_at", -1).limit(10))
-    # convert ObjectId and datetime to JSON-serializable
-    history = []
-    for d in docs:
-        history.append({
-            "score": d.get("score"),
-            "risk_pct": d.get("risk_pct"),
-            "created_at": d.get("created_at").isoformat() if d.get("created_at") else ""
-        })
-    return render_template("vision_history.html", history=history)
+    user = session['username']
+    history = vision_analytics.user_trend(vision_col, user, 10, ANALYTICS_USER_BUCKET_SECONDS)
+    weak_areas = vision_analytics.user_weak_areas(vision_col, user, ANALYTICS_USER_BUCKET_SECONDS)
+    population = population_analytics()
+    latest = history[-1]["score"] if history else None
+    return render_template(
+        "vision_history.html",
+        history=history,
+        weak_areas=weak_areas,
+        percentile=vision_analytics.percentile_rank(population["histogram"], latest),
+        population_median=population["percentiles"].get("p50")
+    )
 
+@app.route("/tech/analytics")
+def tech_analytics():
+    if 'username' not in session or session["role"] != "Technician":
+        return redirect("/login")
+    return render_template("tech_analytics.html", analytics=population_analytics())
 
 # -------------------- Reports --------------------
 @app.route("/report/<image_id>")
@@ -634,20 +1957,34 @@ def view_report(image_id):
     doc = images_col.find_one({"_id": ObjectId(image_id)})
     if not doc:
         return redirect("/patient")
-    return render_template("report_view.html", doc=doc)
-
-@app.route("/report/pdf/<image_id>")
-def report_pdf(image_id):
-    doc = images_col.find_one({"_id": ObjectId(image_id)})
-    if not doc:
-        return redirect("/")
+    return render_template("report_view.html", doc=doc, status=analysis_status(doc))
+
+# Rendered PDFs are kept in memory, keyed by (image id, content version), and
+# served with an ETag so repeat downloads are a cache hit or a 304.
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+_pdf_cache = OrderedDict()
+_pdf_cache_bytes = 0
+_pdf_cache_lock = threading.Lock()
+
+def report_version(doc):
+    h = hashlib.sha256()
+    h.update((doc.get("ai_result") or {}).get("model_response", "").encode())
+    h.update(b"\0")
+    h.update((doc.get("tech_notes") or "").encode())
+    return h.hexdigest()[:32]
+
+@timed_stage("pdf.render")
+def render_report_pdf(doc):
+    text = doc["ai_result"]["model_response"]
+    if doc.get("tech_notes"):
+        text += "\n\nTechnician notes:\n" + doc["tech_notes"]
+    return run_cpu_bound(_draw_report_pdf, text)
 
-    pdf_path = os.path.join(REPORT_FOLDER, f"report_{image_id}.pdf")
-    c = canvas.Canvas(pdf_path, pagesize=letter)
+def _draw_report_pdf(text):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter)
 
     y = 750
-    text = doc["ai_result"]["model_response"]
-
     for line in text.split("\n"):
         c.drawString(50, y, line[:100])
         y -= 14
@@ -656,16 +1993,147 @@ def report_pdf(image_id):
             y = 750
 
     c.save()
-    return send_file(pdf_path, as_attachment=True)
+    return buf.getvalue()
+
+def get_report_pdf(doc, version):
+    global _pdf_cache_bytes
+    key = (str(doc["_id"]), version)
+    with _pdf_cache_lock:
+        data = _pdf_cache.get(key)
+        if data is not None:
+            _pdf_cache.move_to_end(key)
+            return data
+
+    data = render_report_pdf(doc)
+    if len(data) > PDF_CACHE_MAX_BYTES:
+        return data
+
+    with _pdf_cache_lock:
+        if key not in _pdf_cache:
+            _pdf_cache[key] = data
+            _pdf_cache_bytes += len(data)
+        while _pdf_cache_bytes > PDF_CACHE_MAX_BYTES:
+            _, old = _pdf_cache.popitem(last=False)
+            _pdf_cache_bytes -= len(old)
+    return data
+
+@app.route("/report/pdf/<image_id>")
+def report_pdf(image_id):
+    doc = images_col.find_one(
+        {"_id": ObjectId(image_id)},
+        {"ai_result": 1, "tech_notes": 1, "status": 1, "created_at": 1, "analyzed_at": 1, "validated_at": 1}
+    )
+    if not doc:
+        return redirect("/")
+    if analysis_status(doc) != "done":
+        return redirect(url_for("view_report", image_id=image_id))
+
+    version = report_version(doc)
+    last_modified = max(d for d in (doc.get("created_at"), doc.get("analyzed_at"), doc.get("validated_at")) if d)
+    if request.if_none_match.contains(version):
+        resp = app.response_class(status=304)
+        resp.set_etag(version)
+        return resp
+
+    data = get_report_pdf(doc, version)
+    return send_file(
+        io.BytesIO(data),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"report_{image_id}.pdf",
+        etag=version,
+        last_modified=last_modified,
+        max_age=0,
+        conditional=True
+    )
 
 # -------------------- Technician --------------------
+TECH_PAGE_SIZE = 25
+# never pull the report body into the list view
+TECH_SCAN_PROJECTION = {
+    "username": 1, "filename": 1, "filepath": 1, "status": 1,
+    "tech_validated": 1, "created_at": 1
+}
+
+def _encode_scan_cursor(doc):
+    return f"{doc['created_at'].isoformat()}_{doc['_id']}"
+
+def _decode_scan_cursor(value):
+    try:
+        ts, oid = value.rsplit("_", 1)
+        return datetime.fromisoformat(ts), ObjectId(oid)
+    except Exception:
+        return None
+
+def _tech_scan_filters(args):
+    """Build the Mongo filter for the technician list from query args."""
+    query = {}
+    filters = {
+        "validated": args.get("validated", ""),
+        "date_from": args.get("date_from", ""),
+        "date_to": args.get("date_to", "")
+    }
+    if filters["validated"] == "yes":
+        query["tech_validated"] = True
+    elif filters["validated"] == "no":
+        query["tech_validated"] = {"$ne": True}
+
+    created = {}
+    try:
+        if filters["date_from"]:
+            created["$gte"] = datetime.strptime(filters["date_from"], "%Y-%m-%d")
+        if filters["date_to"]:
+            created["$lt"] = datetime.strptime(filters["date_to"], "%Y-%m-%d") + timedelta(days=1)
+    except ValueError:
+        created = {}
+    if created:
+        query["created_at"] = created
+    return query, filters
+
 @app.route("/tech")
 def tech_dashboard():
     if 'username' not in session or session["role"] != "Technician":
         return redirect("/login")
 
-    docs = list(images_col.find().sort("created_at",-1))
-    return render_template("tech_dashboard.html", images=docs)
+    query, filters = _tech_scan_filters(request.args)
+    limit = min(max(request.args.get("limit", TECH_PAGE_SIZE, type=int), 1), 100)
+
+    cursor = _decode_scan_cursor(request.args.get("after", ""))
+    if cursor:
+        ts, oid = cursor
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": ts}},
+            {"created_at": ts, "_id": {"$lt": oid}}
+        ]}]}
+
+    docs = list(
+        images_col.find(query, TECH_SCAN_PROJECTION)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = _encode_scan_cursor(docs[-1])
+
+    return render_template(
+        "tech_dashboard.html",
+        images=docs,
+        filters=filters,
+        limit=limit,
+        next_cursor=next_cursor
+    )
+
+@app.route("/tech/cache_stats")
+def tech_cache_stats():
+    if 'username' not in session or session["role"] != "Technician":
+        return redirect("/login")
+    return jsonify({
+        "analysis_cache": analysis_cache_stats,
+        "chat_cache": chat_cache_hit_rate(),
+        "question_render_cache": dict(render_cache_stats, entries=len(_render_cache)),
+        "analytics_cache": vision_analytics.cache_info()
+    })
 
 @app.route("/tech/validate/<image_id>", methods=["GET","POST"])
 def tech_validate(image_id):
@@ -680,9 +2148,12 @@ def tech_validate(image_id):
             {"_id": ObjectId(image_id)},
             {"$set":{
                 "tech_validated":True,
-                "tech_notes":notes
+                "tech_notes":notes,
+                "validated_at":datetime.utcnow()
             }}
         )
+        if doc:
+            summary_update_scan(doc.get("username"), doc["_id"], tech_validated=True)
         return redirect("/tech")
 
     return render_template("tech_validate.html", doc=doc)
@@ -696,19 +2167,146 @@ def api_upload():
     if not file:
         return jsonify({"error":"no file"})
 
-    path, fname = save_file_storage(file)
-    ai = call_openai_image_analysis_localfile(path)
+    path, fname, sha256, _ = save_file_storage(file)
+    bypass = wants_cache_bypass(request)
+    cached = get_cached_analysis(sha256, bypass)
+    status = "done" if cached else "pending"
 
     doc = {
         "username": username,
         "filename": fname,
         "filepath": path,
-        "ai_result": ai,
+        "sha256": sha256,
+        "ai_result": cached,
+        "status": status,
         "created_at": datetime.utcnow()
     }
 
     res = images_col.insert_one(doc)
-    return jsonify({"success":True,"id":str(res.inserted_id)})
+    summary_add_scans(username, [doc])
+    if not cached:
+        enqueue_analysis(res.inserted_id, path, sha256, bypass, username)
+    image_id = str(res.inserted_id)
+    return jsonify({
+        "success": True,
+        "id": image_id,
+        "status": status,
+        "cached": bool(cached),
+        "status_url": url_for("api_analysis_status", image_id=image_id)
+    })
+
+# Batch upload for clinic devices: one multipart request, many "images".
+# Docs and jobs are written with insert_many and the jobs run right away on a
+# shared pool with their own OpenAI budget (BATCH_ANALYSIS_CONCURRENCY, still
+# within OPENAI_MAX_CONCURRENCY), not the uploader's per-user cap. With wait=1
+# the response carries the finished statuses. The request body may be up to
+# BATCH_MAX_CONTENT_MB; each image is still held to UPLOAD_MAX_BYTES.
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_MAX_CONTENT_LENGTH = int(os.getenv("BATCH_MAX_CONTENT_MB", "256")) * 1024 * 1024
+BATCH_ANALYSIS_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "8"))
+BATCH_WAIT_SECONDS = float(os.getenv("BATCH_WAIT_SECONDS", "90"))
+
+class _UploadRequest(Request):
+    """MAX_CONTENT_LENGTH everywhere except the batch endpoint, which has its own limit."""
+    @property
+    def max_content_length(self):
+        if self.endpoint == "api_upload_batch":
+            return BATCH_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+app.request_class = _UploadRequest
+
+def _file_size(fs):
+    fs.stream.seek(0, os.SEEK_END)
+    size = fs.stream.tell()
+    fs.stream.seek(0)
+    return size
+
+_batch_pool = ThreadPoolExecutor(max_workers=BATCH_ANALYSIS_CONCURRENCY, thread_name_prefix="batch-analysis")
+# batch jobs share this OpenAI budget instead of the uploader's per-user cap
+_batch_openai_slots = threading.BoundedSemaphore(BATCH_ANALYSIS_CONCURRENCY)
+
+def _run_batch_job(job):
+    with openai_budget(_batch_openai_slots):
+        if not _run_analysis_job(job):
+            # put back as queued; the background workers retry it
+            _analysis_wakeup.set()
+
+@app.route("/api/upload/batch", methods=["POST"])
+def api_upload_batch():
+    username = request.form.get("username")
+    files = [f for f in request.files.getlist("images") if f and f.filename]
+    if not files:
+        return jsonify({"error": "no files"}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": "too many files", "max": BATCH_MAX_FILES}), 413
+
+    bypass = wants_cache_bypass(request)
+    wait = str(request.values.get("wait", "")).lower() in ("1", "true", "yes", "on")
+    now = datetime.utcnow()
+    results, docs = [], []
+    for f in files:
+        entry = {"filename": f.filename}
+        results.append(entry)
+        if not allowed_file(f.filename):
+            entry["status"] = "rejected"
+            entry["error"] = "invalid file type"
+            continue
+        if _file_size(f) > UPLOAD_MAX_BYTES:
+            entry["status"] = "rejected"
+            entry["error"] = "file too large"
+            entry["max_bytes"] = UPLOAD_MAX_BYTES
+            continue
+        path, fname, sha256, _ = save_file_storage(f)
+        cached = get_cached_analysis(sha256, bypass)
+        entry["cached"] = bool(cached)
+        docs.append((entry, {
+            "username": username,
+            "filename": fname,
+            "filepath": path,
+            "sha256": sha256,
+            "ai_result": cached,
+            "status": "done" if cached else "pending",
+            "created_at": now
+        }))
+
+    if docs:
+        res = images_col.insert_many([doc for _, doc in docs])
+        summary_add_scans(username, [doc for _, doc in docs])
+        jobs = []
+        for (entry, doc), image_id in zip(docs, res.inserted_ids):
+            entry["id"] = str(image_id)
+            entry["status"] = doc["status"]
+            entry["status_url"] = url_for("api_analysis_status", image_id=entry["id"])
+            if doc["status"] == "pending":
+                jobs.append(_analysis_job_doc(image_id, doc["filepath"], doc["sha256"], bypass, username))
+        enqueue_analysis_many(jobs, claim=True)
+        futures = [_batch_pool.submit(_run_batch_job, job) for job in jobs]
+
+        if wait and jobs:
+            # whatever is still running at the deadline finishes in the background
+            futures_wait(futures, timeout=BATCH_WAIT_SECONDS)
+            by_id = {str(d["_id"]): d for d in images_col.find(
+                {"_id": {"$in": [job["image_id"] for job in jobs]}}, {"status": 1})}
+            for entry, _ in docs:
+                if entry["id"] in by_id:
+                    entry["status"] = analysis_status(by_id[entry["id"]])
+
+    return jsonify({"success": True, "count": len(results), "results": results})
+
+# Poll endpoint for queued analyses
+@app.route("/api/analysis/<image_id>")
+def api_analysis_status(image_id):
+    doc = images_col.find_one({"_id": ObjectId(image_id)}, {"status": 1, "ai_result": 1, "ai_error": 1})
+    if not doc:
+        return jsonify({"error": "not_found"}), 404
+    status = analysis_status(doc)
+    return jsonify({
+        "id": image_id,
+        "status": status,
+        "ready": status == "done",
+        "error": doc.get("ai_error")
+    })
 
 # -------------------- Run --------------------
 if __name__ == "__main__":
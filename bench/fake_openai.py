@@ -0,0 +1,131 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests.
+Run:
+    python bench/fake_openai.py --port 8765 --latency-ms 800 --error-rate 0.02
+
+Then point the app at it (openai 0.28 reads this at import time):
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python app.py
+
+Implements POST /v1/chat/completions, including stream=True (SSE chunks).
+Latency is drawn per call from a normal distribution around --latency-ms.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED = (
+    "English: No acute disease visible. Symptoms: none reported. "
+    "What to do: regular check-ups. What NOT to do: rub your eyes.\n"
+    "Tamil: கண்ணில் தீவிர நோய் எதுவும் தெரியவில்லை.\n"
+    "Risk level: Low"
+)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency_ms = 800
+    jitter_ms = 200
+    error_rate = 0.0
+    calls = 0
+    calls_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        req = json.loads(self.rfile.read(length) or b"{}")
+        with self.calls_lock:
+            type(self).calls += 1
+
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        if random.random() < self.error_rate:
+            time.sleep(delay / 4)
+            return self._json(random.choice([429, 500, 503]), {"error": {"message": "fake upstream error", "type": "server_error"}})
+
+        model = req.get("model", "gpt-4o-mini")
+        if req.get("stream"):
+            return self._stream(model, delay)
+
+        time.sleep(delay)
+        self._json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": CANNED},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 50, "completion_tokens": 80, "total_tokens": 130}
+        })
+
+    def _stream(self, model, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = CANNED.split(" ")
+        # first token after ~1/4 of the latency, the rest spread over the remainder
+        time.sleep(delay / 4)
+        step = (delay * 3 / 4) / max(1, len(words))
+        for i, w in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": w + (" " if i < len(words) - 1 else "")}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(step)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_fake_openai(port=0, latency_ms=800, jitter_ms=200, error_rate=0.0):
+    """Start the fake server in a daemon thread. Returns (server, base_url)."""
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "error_rate": error_rate,
+        "calls": 0,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, url = start_fake_openai(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print("✔ Fake OpenAI listening on", url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
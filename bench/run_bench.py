@@ -0,0 +1,291 @@
+"""
+End-to-end load test for the eye app, without OpenAI or a shared Mongo.
+Run:
+    python bench/run_bench.py                          # 10 users, 30 s, mongomock
+    python bench/run_bench.py --users 50 --duration 120 --latency-ms 1500
+    python bench/run_bench.py --mongo-url mongodb://localhost:27017/   # scratch mongod
+    python bench/run_bench.py --json bench_output.json --compare old.json
+
+The app is served in-process by werkzeug's threaded server and talks to the
+fake OpenAI server from bench/fake_openai.py. Each virtual user logs in once,
+then picks scenarios by weight until the deadline:
+    login, upload, api_upload, patient, tech, quiz (start -> 7 answers -> finish), report_pdf
+Per-route throughput and p50/p95/p99 are printed and, with --json, saved
+together with the git commit so runs can be compared across commits.
+Uploads and rendered quiz images go to a temp dir that is removed on exit,
+so the checkout's static/ folder is left untouched.
+"""
+
+import argparse
+import atexit
+import io
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+DEFAULT_MIX = "login=1,upload=2,api_upload=2,patient=4,tech=1,quiz=2,report_pdf=2"
+
+
+# -------------------- Recording --------------------
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route, seconds, ok):
+        with self.lock:
+            self.samples[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+    def timed(self, route, fn):
+        start = time.perf_counter()
+        try:
+            resp = fn()
+            ok = resp.status_code < 500
+        except Exception:
+            resp, ok = None, False
+        self.record(route, time.perf_counter() - start, ok)
+        return resp
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0.0
+    # nearest-rank
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(pct / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route, vals in sorted(recorder.samples.items()):
+        vals = sorted(vals)
+        routes[route] = {
+            "count": len(vals),
+            "errors": recorder.errors[route],
+            "rps": len(vals) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(vals, 50) * 1000,
+            "p95_ms": percentile(vals, 95) * 1000,
+            "p99_ms": percentile(vals, 99) * 1000,
+        }
+    return routes
+
+
+def print_table(routes, previous=None):
+    head = f"{'route':<24}{'count':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if previous:
+        head += f"{'Δp50':>9}{'Δp95':>9}"
+    print(head)
+    print("-" * len(head))
+    for route, r in routes.items():
+        line = (f"{route:<24}{r['count']:>8}{r['errors']:>6}{r['rps']:>9.1f}"
+                f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+        old = (previous or {}).get(route)
+        if old:
+            line += f"{r['p50_ms'] - old['p50_ms']:>+9.1f}{r['p95_ms'] - old['p95_ms']:>+9.1f}"
+        print(line)
+
+
+# -------------------- App under test --------------------
+def start_app(args, openai_base):
+    os.environ["OPENAI_API_BASE"] = openai_base
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    os.environ.setdefault("SECRET_KEY", "bench")
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    else:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    # the question bank and game assets are read relative to the checkout;
+    # everything the app writes goes to a scratch dir instead
+    scratch = tempfile.mkdtemp(prefix="eye-bench-")
+    atexit.register(shutil.rmtree, scratch, True)
+    os.environ["UPLOAD_FOLDER"] = os.path.join(scratch, "uploads")
+    os.environ["RENDERED_FOLDER"] = os.path.join(scratch, "rendered")
+    os.chdir(ROOT)
+
+    import openai
+    openai.api_base = openai_base
+    from werkzeug.serving import make_server
+    import app as eye_app
+
+    server = make_server("127.0.0.1", 0, eye_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def make_image(unique):
+    from PIL import Image
+    seed = random.getrandbits(32) if unique else 42
+    rnd = random.Random(seed)
+    im = Image.new("RGB", (256, 256), (rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255)))
+    for _ in range(40):
+        x, y = rnd.randint(0, 250), rnd.randint(0, 250)
+        im.paste((rnd.randint(0, 255), 40, 40), (x, y, x + 6, y + 6))
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+# -------------------- Virtual users --------------------
+class VirtualUser:
+    def __init__(self, base, rec, args, name, role="Patient"):
+        import requests
+        self.base, self.rec, self.args = base, rec, args
+        self.name, self.role = name, role
+        self.http = requests.Session()
+        self.image_ids = []
+
+    def url(self, path):
+        return self.base + path
+
+    def register_and_login(self):
+        self.http.post(self.url("/register"), data={"username": self.name, "password": "pw", "role": self.role},
+                       allow_redirects=False)
+        self.login()
+
+    def login(self):
+        return self.rec.timed("POST /login", lambda: self.http.post(
+            self.url("/login"), data={"username": self.name, "password": "pw"}, allow_redirects=False))
+
+    def upload(self):
+        data = make_image(random.random() < self.args.unique_images)
+        resp = self.rec.timed("POST /upload", lambda: self.http.post(
+            self.url("/upload"), files={"eye_image": ("eye.jpg", data, "image/jpeg")}, allow_redirects=False))
+        if resp is not None and "/report/" in resp.headers.get("Location", ""):
+            self.image_ids.append(resp.headers["Location"].rsplit("/", 1)[-1])
+
+    def api_upload(self):
+        data = make_image(random.random() < self.args.unique_images)
+        resp = self.rec.timed("POST /api/upload", lambda: self.http.post(
+            self.url("/api/upload"), data={"username": self.name},
+            files={"image": ("eye.jpg", data, "image/jpeg")}))
+        if resp is not None and resp.ok:
+            self.image_ids.append(resp.json().get("id"))
+
+    def patient(self):
+        self.rec.timed("GET /patient", lambda: self.http.get(self.url("/patient")))
+
+    def tech(self):
+        self.rec.timed("GET /tech", lambda: self.http.get(self.url("/tech")))
+
+    def report_pdf(self):
+        if not self.image_ids:
+            return self.upload()
+        image_id = random.choice(self.image_ids)
+        self.rec.timed("GET /report/pdf/<id>", lambda: self.http.get(
+            self.url(f"/report/pdf/{image_id}"), allow_redirects=False))
+
+    def quiz(self):
+        self.rec.timed("GET /vision_quiz/start", lambda: self.http.get(
+            self.url("/vision_quiz/start"), allow_redirects=False))
+        self.rec.timed("GET /vision_quiz", lambda: self.http.get(self.url("/vision_quiz")))
+        for i in range(7):
+            self.rec.timed("POST /vision_quiz/api/answer", lambda i=i: self.http.post(
+                self.url("/vision_quiz/api/answer"),
+                json={"index": i, "answer": random.choice(["Left", "Clear", "12", "Circle"]), "advance": True}))
+        self.rec.timed("POST /vision_quiz/finish", lambda: self.http.post(self.url("/vision_quiz/finish")))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_user(user, tech, mix, deadline):
+    names, weights = list(mix), list(mix.values())
+    while time.time() < deadline:
+        scenario = random.choices(names, weights)[0]
+        if scenario == "tech":
+            tech.tech()
+        else:
+            getattr(user, scenario)()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,... (default: %(default)s)")
+    parser.add_argument("--latency-ms", type=float, default=800, help="fake OpenAI mean latency")
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake OpenAI error rate (0-1)")
+    parser.add_argument("--unique-images", type=float, default=0.5, help="share of uploads with new bytes")
+    parser.add_argument("--mongo-url", default="", help="scratch mongod; default is mongomock")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default="", help="write results to this file")
+    parser.add_argument("--compare", default="", help="previous --json output to diff against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    _, openai_base = start_fake_openai(0, args.latency_ms, args.jitter_ms, args.error_rate)
+    _, base = start_app(args, openai_base)
+
+    rec = Recorder()
+    run_id = int(time.time())
+    tech = VirtualUser(base, rec, args, f"bench_tech_{run_id}", role="Technician")
+    tech.register_and_login()
+    users = [VirtualUser(base, rec, args, f"bench_user_{run_id}_{i}") for i in range(args.users)]
+    for u in users:
+        u.register_and_login()
+    rec.samples.clear()
+    rec.errors.clear()
+
+    mix = parse_mix(args.mix)
+    start = time.time()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_user, args=(u, tech, mix, deadline)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    routes = summarize(rec, elapsed)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["routes"]
+        print(f"comparing against {args.compare}")
+    print_table(routes, previous)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+                "elapsed_s": elapsed,
+                "routes": routes,
+            }, f, indent=2)
+        print("✔ Results saved to:", args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Create the MongoDB indexes the app relies on and verify the hot queries use them.
+Run:
+    python check_indexes.py            # create indexes, then explain hot queries
+    python check_indexes.py --check    # only explain, don't create
+
+Exits with status 1 if any index could not be created or any hot query is
+planned as a COLLSCAN.
+"""
+
+import sys
+
+from app import ensure_indexes, find_collscans
+
+
+def main(argv):
+    failed = []
+    if "--check" not in argv:
+        failed = ensure_indexes()
+        for col, keys, err in failed:
+            print("✘ Index", keys, "on", col, "failed:", err)
+        if not failed:
+            print("✔ Indexes ensured")
+
+    bad = find_collscans()
+    for q in bad:
+        print("✘ COLLSCAN:", q)
+    if failed or bad:
+        return 1
+
+    print("✔ All hot queries use an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,23 +2,52 @@
 Generate 40 vision test images + Excel question file.
 Run:
     python generate_vision_questions.py
+    python generate_vision_questions.py --seed 7 --workers 8
+    python generate_vision_questions.py --force        # re-render every image
+
+    python generate_vision_questions.py --bulk 500   # +500 extra questions per category
+    python generate_vision_questions.py --renderer numpy  # array renderer (needs numpy)
 
 Outputs:
- - static/games/questions/q01.png ... q40.png
+ - static/games/questions/q01.png ... q40.png (q41.png ... with --bulk)
+ - static/games/questions/manifest.json   (parameter hash per image)
  - static/games/vision_questions_40.xlsx
+
+Generation is deterministic for a given --seed: every question gets its own
+RNG derived from (seed, id), so the same seed always yields the same images
+and answers. Images whose parameters hash to the manifest entry are left
+untouched (keeping browser caches valid); the rest render in a process pool.
+The Excel and the manifest are written to a temp file and renamed into place.
+
+The default renderer is the per-shape PIL drawing. --renderer numpy
+(vision_raster.py) renders blur charts from a cached blurred-glyph mask; on
+one core that is about 1.25x images/s on a --bulk bank, so it stays opt-in
+and vision_raster is only imported when it is selected. PIL specs hash exactly as before the renderer
+option existed, so switching back keeps existing manifests and caches valid.
 """
 
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import argparse
+import hashlib
+import io
+import json
 import os, random
 import pandas as pd
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # Output paths
 BASE = Path(__file__).parent.resolve()
 OUT_IMG_DIR = BASE / "static" / "games" / "questions"
-OUT_IMG_DIR.mkdir(parents=True, exist_ok=True)
-
 EXCEL_PATH = BASE / "static" / "games" / "vision_questions_40.xlsx"
+MANIFEST_PATH = OUT_IMG_DIR / "manifest.json"
+
+DEFAULT_SEED = 40
+DEFAULT_RENDERER = "pil"
+# bump when drawing code changes so every image is re-rendered
+RENDER_VERSION = 1
+SIZE = 512
 
 # Load font safely
 def get_font(size):
@@ -34,11 +63,15 @@ def get_font(size):
             pass
     return ImageFont.load_default()
 
-FONT_LG = get_font(160)
-FONT_MD = get_font(120)
-FONT_SM = get_font(40)
+_fonts = {}
 
-questions = []
+def font(size):
+    # loaded lazily so pool workers each load their own copy once
+    if size not in _fonts:
+        _fonts[size] = get_font(size)
+    return _fonts[size]
+
+FONT_LG, FONT_MD, FONT_SM = 160, 120, 40
 
 def text_center(draw, text, font, w, h):
     """Center text using textbbox() --> Pillow 10 compatible."""
@@ -47,206 +80,392 @@ def text_center(draw, text, font, w, h):
     th = bbox[3] - bbox[1]
     return (w - tw) // 2, (h - th) // 2
 
+def question_rng(seed, qid):
+    return random.Random(f"{seed}:{qid}")
+
 # ---------------------------------------------------------
-# 1–10: Ishihara-like color plates
+# Question specs: everything needed to draw an image and
+# write its Excel row, with no randomness left at render time.
 # ---------------------------------------------------------
-numbers = ["12","6","29","8","5","3","15","7","2","10"]
-
-for i in range(1, 11):
-    fname = f"q{i:02d}.png"
-    im = Image.new("RGB", (512,512), (255,255,255))
-    draw = ImageDraw.Draw(im)
-
-    # Scatter colored dots
-    for _ in range(700):
-        x, y = random.randint(0,511), random.randint(0,511)
-        r = random.randint(3,12)
-        color = (
-            random.randint(80,200),
-            random.randint(90,210),
-            random.randint(90,220)
-        )
-        draw.ellipse((x-r,y-r,x+r,y+r), fill=color)
-
-    number = numbers[(i-1) % len(numbers)]
-    tx, ty = text_center(draw, number, FONT_MD, 512, 512)
-    draw.text((tx, ty), number, font=FONT_MD, fill=(20,20,20))
-
-    im.save(OUT_IMG_DIR / fname)
-
+def color_plate_spec(qid, number, rng):
     # Options
     correct = number
-    distract = {correct, str(int(correct)+1), str(int(correct)-1), str(int(correct)+2)}
-    opts = list(distract)
-    random.shuffle(opts)
-
-    questions.append({
-        "id": i,
-        "image": f"questions/{fname}",
-        "option1": opts[0],
-        "option2": opts[1],
-        "option3": opts[2],
-        "option4": opts[3],
-        "answer": correct
-    })
-
-# ---------------------------------------------------------
-# 11–20: Blur test
-# ---------------------------------------------------------
-blur_words = ["CENTER","LEFT","RIGHT","CIRCLE","STAR","HOUSE","TREE","SNAKE","CLOUD","RIVER"]
-
-for idx, txt in enumerate(blur_words, start=11):
-    fname = f"q{idx:02d}.png"
-
-    base = Image.new("RGB", (512,512), (245,245,250))
-    draw = ImageDraw.Draw(base)
-
-    tx, ty = text_center(draw, txt, FONT_MD, 512, 512)
-    draw.text((tx, ty), txt, font=FONT_MD, fill=(10,10,10))
-
-    blur_amount = random.randint(0,5)
-    im = base.filter(ImageFilter.GaussianBlur(radius=blur_amount))
-    im.save(OUT_IMG_DIR / fname)
-
-    options = ["Clear", "Slightly Blurry", "Very Blurry", "Cannot See"]
-
+    opts = list({correct, str(int(correct)+1), str(int(correct)-1), str(int(correct)+2)})
+    opts.sort()
+    rng.shuffle(opts)
+    return {
+        "id": qid, "category": "color_plate",
+        "params": {"number": number, "dots": 700, "dot_seed": rng.getrandbits(32)},
+        "options": opts, "answer": correct
+    }
+
+def blur_spec(qid, word, rng):
+    blur_amount = rng.randint(0, 5)
     if blur_amount <= 1:
         ans = "Clear"
     elif blur_amount <= 3:
         ans = "Slightly Blurry"
     else:
         ans = "Very Blurry"
+    return {
+        "id": qid, "category": "blur",
+        "params": {"word": word, "blur": blur_amount},
+        "options": ["Clear", "Slightly Blurry", "Very Blurry", "Cannot See"], "answer": ans
+    }
+
+CONTRAST_LEVELS = [1.0, 0.6, 0.35, 0.2, 0.1, 0.05]
 
-    questions.append({
-        "id": idx,
-        "image": f"questions/{fname}",
-        "option1": options[0],
-        "option2": options[1],
-        "option3": options[2],
-        "option4": options[3],
-        "answer": ans
-    })
+def contrast_spec(qid, word, rng):
+    contrast = rng.choice(CONTRAST_LEVELS)
+    if contrast >= 0.5:
+        ans = "Clear"
+    elif contrast >= 0.2:
+        ans = "Faint"
+    else:
+        ans = "Very Faint"
+    return {
+        "id": qid, "category": "contrast",
+        "params": {"word": word, "contrast": contrast},
+        "options": ["Clear", "Faint", "Very Faint", "Cannot See"], "answer": ans
+    }
+
+def peripheral_spec(qid, direction, rng, **extra):
+    return {
+        "id": qid, "category": "peripheral",
+        "params": dict({"direction": direction}, **extra),
+        "options": ["Left", "Right", "Top", "Bottom"], "answer": direction
+    }
+
+def e_chart_spec(qid, orientation, rng, **extra):
+    return {
+        "id": qid, "category": "e_chart",
+        "params": dict({"orientation": orientation}, **extra),
+        "options": ["Up", "Down", "Left", "Right"], "answer": orientation
+    }
+
+SHAPES = ["Circle","Square","Triangle","Star","Hexagon","Diamond"]
+
+def shape_spec(qid, shape, rng, **extra):
+    # three distractors plus the answer, so the correct shape is always offered
+    opts = rng.sample([s for s in SHAPES if s != shape], 3) + [shape]
+    rng.shuffle(opts)
+    return {
+        "id": qid, "category": "shape",
+        "params": dict({"shape": shape}, **extra),
+        "options": opts, "answer": shape
+    }
+
+BLUR_WORDS = ["CENTER","LEFT","RIGHT","CIRCLE","STAR","HOUSE","TREE","SNAKE","CLOUD","RIVER",
+              "BOOK","CHAIR","PLANT","WATER","LIGHT","APPLE","HORSE","TRAIN","SMILE","EAGLE"]
+
+def build_specs(seed=DEFAULT_SEED, renderer=DEFAULT_RENDERER, bulk=0):
+    """The fixed 40-question bank, plus `bulk` randomized questions per category."""
+    specs = base_specs(seed)
+    if bulk:
+        specs += bulk_specs(seed, bulk, start_id=len(specs) + 1)
+    for spec in specs:
+        spec["renderer"] = renderer
+    return specs
+
+# category -> maker(qid, rng) drawing every parameter from rng; used by --bulk
+# and by the app's on-demand /vision_quiz/image/<qid> questions
+RANDOM_SPEC_MAKERS = {
+    "color_plate": lambda qid, rng: color_plate_spec(qid, str(rng.randint(2, 99)), rng),
+    "blur": lambda qid, rng: blur_spec(qid, rng.choice(BLUR_WORDS), rng),
+    "contrast": lambda qid, rng: contrast_spec(qid, rng.choice(BLUR_WORDS), rng),
+    "peripheral": lambda qid, rng: peripheral_spec(qid, rng.choice(["Left","Right","Top","Bottom"]), rng,
+                                                   offset=rng.randint(30, 90), radius=rng.randint(8, 18)),
+    "e_chart": lambda qid, rng: e_chart_spec(qid, rng.choice(["Up","Down","Left","Right"]), rng,
+                                             font_size=rng.choice([80, 100, 120, 160])),
+    "shape": lambda qid, rng: shape_spec(qid, rng.choice(SHAPES), rng,
+                                         color=[rng.randint(20, 120), rng.randint(60, 160), rng.randint(150, 230)]),
+}
+
+def bulk_specs(seed, per_category, start_id):
+    specs = []
+    qid = start_id
+    for make in RANDOM_SPEC_MAKERS.values():
+        for _ in range(per_category):
+            specs.append(make(qid, question_rng(seed, qid)))
+            qid += 1
+    return specs
+
+def procedural_spec(category, seed, renderer=DEFAULT_RENDERER):
+    """
+    One randomized question fully determined by (category, seed); its id is
+    the string "<category>-<seed>". Raises KeyError for unknown categories.
+    """
+    qid = f"{category}-{seed}"
+    spec = RANDOM_SPEC_MAKERS[category](qid, question_rng(category, seed))
+    spec["renderer"] = renderer
+    return spec
+
+def base_specs(seed=DEFAULT_SEED):
+    specs = []
+    # 1–10: Ishihara-like color plates
+    numbers = ["12","6","29","8","5","3","15","7","2","10"]
+    for i in range(1, 11):
+        specs.append(color_plate_spec(i, numbers[(i-1) % len(numbers)], question_rng(seed, i)))
+    # 11–20: Blur test
+    blur_words = ["CENTER","LEFT","RIGHT","CIRCLE","STAR","HOUSE","TREE","SNAKE","CLOUD","RIVER"]
+    for idx, txt in enumerate(blur_words, start=11):
+        specs.append(blur_spec(idx, txt, question_rng(seed, idx)))
+    # 21–28: Peripheral vision test
+    dirs = ["Left","Right","Top","Bottom","Left","Right","Top","Bottom"]
+    for j, d in enumerate(dirs, start=21):
+        specs.append(peripheral_spec(j, d, question_rng(seed, j)))
+    # 29–34: E-chart orientation
+    orientations = ["Up","Down","Left","Right","Up","Left"]
+    for k, ori in enumerate(orientations, start=29):
+        specs.append(e_chart_spec(k, ori, question_rng(seed, k)))
+    # 35–40: Shape test
+    for m in range(35, 41):
+        specs.append(shape_spec(m, SHAPES[(m-35) % len(SHAPES)], question_rng(seed, m)))
+    return specs
+
+def spec_hash(spec):
+    payload = {"v": RENDER_VERSION, "category": spec["category"], "params": spec["params"]}
+    # only non-default renderers are hashed, so PIL images keep their old hashes
+    if spec.get("renderer", "pil") != "pil":
+        payload["renderer"] = spec["renderer"]
+    payload = json.dumps(payload, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
 
 # ---------------------------------------------------------
-# 21–28: Peripheral vision test
+# Drawing
 # ---------------------------------------------------------
-dirs = ["Left","Right","Top","Bottom","Left","Right","Top","Bottom"]
+def draw_color_plate(p):
+    im = Image.new("RGB", (SIZE,SIZE), (255,255,255))
+    draw = ImageDraw.Draw(im)
+    rng = random.Random(p["dot_seed"])
+
+    # Scatter colored dots
+    for _ in range(p["dots"]):
+        x, y = rng.randint(0,SIZE-1), rng.randint(0,SIZE-1)
+        r = rng.randint(3,12)
+        color = (
+            rng.randint(80,200),
+            rng.randint(90,210),
+            rng.randint(90,220)
+        )
+        draw.ellipse((x-r,y-r,x+r,y+r), fill=color)
+
+    tx, ty = text_center(draw, p["number"], font(FONT_MD), SIZE, SIZE)
+    draw.text((tx, ty), p["number"], font=font(FONT_MD), fill=(20,20,20))
+    return im
+
+def draw_blur(p):
+    base = Image.new("RGB", (SIZE,SIZE), (245,245,250))
+    draw = ImageDraw.Draw(base)
+
+    tx, ty = text_center(draw, p["word"], font(FONT_MD), SIZE, SIZE)
+    draw.text((tx, ty), p["word"], font=font(FONT_MD), fill=(10,10,10))
+
+    return base.filter(ImageFilter.GaussianBlur(radius=p["blur"]))
 
-for j, d in enumerate(dirs, start=21):
-    fname = f"q{j:02d}.png"
-    im = Image.new("RGB", (512,512), (255,255,255))
+def draw_peripheral(p):
+    im = Image.new("RGB", (SIZE,SIZE), (255,255,255))
     draw = ImageDraw.Draw(im)
 
     # dim grid
-    for x in range(0,512,32):
-        draw.line([(x,0),(x,512)], fill=(230,230,230))
-
-    if d=="Left":      pos = (60,256)
-    elif d=="Right":   pos = (452,256)
-    elif d=="Top":     pos = (256,60)
-    else:              pos = (256,452)
-
-    draw.ellipse((pos[0]-15,pos[1]-15,pos[0]+15,pos[1]+15), fill=(0,140,0))
-    im.save(OUT_IMG_DIR / fname)
-
-    questions.append({
-        "id": j,
-        "image": f"questions/{fname}",
-        "option1": "Left",
-        "option2": "Right",
-        "option3": "Top",
-        "option4": "Bottom",
-        "answer": d
-    })
+    for x in range(0,SIZE,32):
+        draw.line([(x,0),(x,SIZE)], fill=(230,230,230))
 
-# ---------------------------------------------------------
-# 29–34: E-chart orientation
-# ---------------------------------------------------------
-orientations = ["Up","Down","Left","Right","Up","Left"]
+    d = p["direction"]
+    off = p.get("offset", 60)
+    if d=="Left":      pos = (off,256)
+    elif d=="Right":   pos = (SIZE-off,256)
+    elif d=="Top":     pos = (256,off)
+    else:              pos = (256,SIZE-off)
 
-for k, ori in enumerate(orientations, start=29):
-    fname = f"q{k:02d}.png"
-    im = Image.new("RGBA", (512,512), (255,255,255,255))
-    draw = ImageDraw.Draw(im)
+    r = p.get("radius", 15)
+    draw.ellipse((pos[0]-r,pos[1]-r,pos[0]+r,pos[1]+r), fill=(0,140,0))
+    return im
+
+def draw_e_chart(p):
+    im = Image.new("RGBA", (SIZE,SIZE), (255,255,255,255))
 
     e_img = Image.new("RGBA", (200,200), (0,0,0,0))
     ed = ImageDraw.Draw(e_img)
-    ed.text((10,10), "E", font=FONT_LG, fill=(20,20,20))
+    ed.text((10,10), "E", font=font(p.get("font_size", FONT_LG)), fill=(20,20,20))
 
-    rot = {"Up":0,"Right":270,"Left":90,"Down":180}[ori]
+    rot = {"Up":0,"Right":270,"Left":90,"Down":180}[p["orientation"]]
     e_img = e_img.rotate(rot, expand=True)
 
     ex, ey = e_img.size
-    im.paste(e_img, ((512-ex)//2, (512-ey)//2), e_img)
-    im = im.convert("RGB")
-
-    im.save(OUT_IMG_DIR / fname)
-
-    questions.append({
-        "id": k,
-        "image": f"questions/{fname}",
-        "option1": "Up",
-        "option2": "Down",
-        "option3": "Left",
-        "option4": "Right",
-        "answer": ori
-    })
-
-# ---------------------------------------------------------
-# 35–40: Shape test
-# ---------------------------------------------------------
-shapes = ["Circle","Square","Triangle","Star","Hexagon","Diamond"]
+    im.paste(e_img, ((SIZE-ex)//2, (SIZE-ey)//2), e_img)
+    return im.convert("RGB")
 
-for m in range(35, 41):
-    fname = f"q{m:02d}.png"
-    im = Image.new("RGB", (512,512), (240,245,255))
+def draw_shape(p):
+    im = Image.new("RGB", (SIZE,SIZE), (240,245,255))
     draw = ImageDraw.Draw(im)
 
-    shape = shapes[(m-35) % len(shapes)]
+    shape = p["shape"]
+    fill = tuple(p.get("color", (40,110,200)))
     cx, cy = 256, 256
 
     draw.rectangle([80,120,432,392], fill=(225,230,245))
 
     if shape == "Circle":
-        draw.ellipse([cx-80,cy-80,cx+80,cy+80], fill=(40,110,200))
+        draw.ellipse([cx-80,cy-80,cx+80,cy+80], fill=fill)
     elif shape == "Square":
-        draw.rectangle([cx-80,cy-80,cx+80,cy+80], fill=(40,110,200))
+        draw.rectangle([cx-80,cy-80,cx+80,cy+80], fill=fill)
     elif shape == "Triangle":
-        draw.polygon([(cx,cy-90),(cx-90,cy+70),(cx+90,cy+70)], fill=(40,110,200))
+        draw.polygon([(cx,cy-90),(cx-90,cy+70),(cx+90,cy+70)], fill=fill)
     elif shape == "Star":
         draw.polygon([
             (cx,cy-90),(cx+25,cy-10),(cx+90,cy-10),(cx+40,cy+30),
             (cx+55,cy+90),(cx,cy+45),(cx-55,cy+90),(cx-40,cy+30),
             (cx-90,cy-10),(cx-25,cy-10)
-        ], fill=(40,110,200))
+        ], fill=fill)
     elif shape == "Hexagon":
         draw.polygon([
             (cx-60,cy-30),(cx-30,cy-70),(cx+30,cy-70),
             (cx+60,cy-30),(cx+30,cy+30),(cx-30,cy+30)
-        ], fill=(40,110,200))
+        ], fill=fill)
     else:  # Diamond
-        draw.polygon([(cx,cy-80),(cx+60,cy),(cx,cy+80),(cx-60,cy)], fill=(40,110,200))
+        draw.polygon([(cx,cy-80),(cx+60,cy),(cx,cy+80),(cx-60,cy)], fill=fill)
+    return im
 
-    im.save(OUT_IMG_DIR / fname)
+def contrast_color(p, bg=(245,245,250)):
+    # text color between the background (contrast 0) and near-black (contrast 1)
+    return tuple(int(round(c * (1 - p["contrast"]) + 10 * p["contrast"])) for c in bg)
 
-    opts = shapes.copy()
-    random.shuffle(opts)
-
-    questions.append({
-        "id": m,
-        "image": f"questions/{fname}",
+def draw_contrast(p):
+    im = Image.new("RGB", (SIZE,SIZE), (245,245,250))
+    draw = ImageDraw.Draw(im)
+    tx, ty = text_center(draw, p["word"], font(FONT_MD), SIZE, SIZE)
+    draw.text((tx, ty), p["word"], font=font(FONT_MD), fill=contrast_color(p))
+    return im
+
+# ---- numpy renderer (vision_raster.py, imported on use) ----
+def draw_blur_np(p):
+    import vision_raster
+    mask = vision_raster.cached_mask(p["word"], font(FONT_MD), SIZE, sigma=p["blur"])
+    return Image.fromarray(vision_raster.composite(vision_raster.solid(SIZE, (245,245,250)), mask, (10,10,10)))
+
+DRAWERS = {
+    "color_plate": draw_color_plate,
+    "blur": draw_blur,
+    "contrast": draw_contrast,
+    "peripheral": draw_peripheral,
+    "e_chart": draw_e_chart,
+    "shape": draw_shape,
+}
+
+# categories without an array version fall back to DRAWERS: colour plates
+# measured at parity with an array rasterizer, and the single-call PIL
+# drawers (contrast, peripheral, e_chart, shape) are already ~1 ms
+NUMPY_DRAWERS = {
+    "blur": draw_blur_np,
+}
+
+def render_png(spec, png_level=6):
+    """PNG bytes for a spec (used by the app's render cache)."""
+    buf = io.BytesIO()
+    render_image(spec).save(buf, "PNG", compress_level=png_level)
+    return buf.getvalue()
+
+def render_image(spec):
+    """Draw the PIL image for a question spec."""
+    if spec.get("renderer", "pil") == "numpy" and spec["category"] in NUMPY_DRAWERS:
+        return NUMPY_DRAWERS[spec["category"]](spec["params"])
+    return DRAWERS[spec["category"]](spec["params"])
+
+def image_name(spec):
+    return f"q{spec['id']:02d}.png"
+
+def render_to_file(spec, out_dir=OUT_IMG_DIR, png_level=6):
+    """Pool worker: render one question and atomically replace its PNG."""
+    out = Path(out_dir) / image_name(spec)
+    tmp = out.with_suffix(".tmp.png")
+    render_image(spec).save(tmp, compress_level=png_level)
+    os.replace(tmp, out)
+    return out.name
+
+def question_record(spec):
+    """Question bank row for a spec, without the image column."""
+    opts = spec["options"]
+    return {
+        "id": spec["id"],
+        "category": spec["category"],
         "option1": opts[0],
         "option2": opts[1],
         "option3": opts[2],
         "option4": opts[3],
-        "answer": shape
-    })
+        "answer": spec["answer"]
+    }
+
+def excel_row(spec):
+    row = question_record(spec)
+    row["image"] = f"questions/{image_name(spec)}"
+    return row
 
 # ---------------------------------------------------------
-# Save Excel
+# Atomic writes
 # ---------------------------------------------------------
-df = pd.DataFrame(questions)
-df.to_excel(EXCEL_PATH, index=False)
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(manifest, path=MANIFEST_PATH):
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def write_excel(rows, path=EXCEL_PATH):
+    tmp = Path(path).with_suffix(".tmp.xlsx")
+    pd.DataFrame(rows).to_excel(tmp, index=False, engine="openpyxl")
+    os.replace(tmp, path)
 
-print("✔ Images saved to:", OUT_IMG_DIR)
-print("✔ Excel saved to:", EXCEL_PATH)
+# ---------------------------------------------------------
+# Main
+# ---------------------------------------------------------
+def generate(specs, workers=None, force=False, out_dir=OUT_IMG_DIR,
+             excel_path=EXCEL_PATH, manifest_path=MANIFEST_PATH, png_level=6):
+    """Render changed images in a process pool, then write Excel + manifest. Returns rendered names."""
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    old = {} if force else load_manifest(manifest_path)
+    manifest = {image_name(s): spec_hash(s) for s in specs}
+    todo = [s for s in specs
+            if old.get(image_name(s)) != manifest[image_name(s)] or not (Path(out_dir) / image_name(s)).exists()]
+
+    rendered = []
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        # big chunks keep each worker's glyph/blur mask cache hot
+        chunk = max(4, len(todo) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(render_to_file, todo, [out_dir] * len(todo),
+                                     [png_level] * len(todo), chunksize=chunk))
+
+    write_excel([excel_row(s) for s in specs], excel_path)
+    write_manifest(manifest, manifest_path)
+    return rendered
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--workers", type=int, default=None, help="default: CPU count")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and re-render everything")
+    parser.add_argument("--renderer", choices=["numpy", "pil"], default=DEFAULT_RENDERER)
+    parser.add_argument("--bulk", type=int, default=0, help="extra randomized questions per category")
+    parser.add_argument("--png-level", type=int, default=6, help="PNG compression 0-9 (lower is faster)")
+    args = parser.parse_args()
+
+    specs = build_specs(args.seed, args.renderer, args.bulk)
+    started = time.perf_counter()
+    rendered = generate(specs, workers=args.workers, force=args.force, png_level=args.png_level)
+    elapsed = time.perf_counter() - started
+
+    print(f"✔ Rendered {len(rendered)} of {len(specs)} images ({len(specs) - len(rendered)} unchanged)"
+          f" in {elapsed:.1f}s ({len(rendered) / max(elapsed, 1e-9):.0f} images/s)")
+    print("✔ Images saved to:", OUT_IMG_DIR)
+    print("✔ Excel saved to:", EXCEL_PATH)
+
+if __name__ == "__main__":
+    main()
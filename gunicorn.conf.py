@@ -0,0 +1,48 @@
+"""
+gunicorn settings (picked up automatically from the working directory).
+Run:
+    gunicorn app:app
+
+The AI-bound routes (upload, /api/upload, chatbot, vision_quiz/finish) spend
+nearly all their time waiting on OpenAI and Mongo. With the default gevent
+worker class each request is a greenlet: the monkey-patched sockets used by
+requests/openai and pymongo yield while waiting, so one worker process holds
+hundreds of in-flight AI calls instead of one per sync worker. Pillow and
+reportlab work is pushed to gevent's thread pool (app.run_cpu_bound), so the
+CPU-only routes keep working unchanged.
+
+Environment:
+    GUNICORN_WORKER_CLASS         gevent (default) | gthread | sync
+    GUNICORN_WORKERS              processes (default: CPU count)
+    GUNICORN_WORKER_CONNECTIONS   greenlets per gevent worker (default 1000)
+    GUNICORN_THREADS              threads per gthread worker (default 8)
+    OPENAI_MAX_CONCURRENCY        in-flight model calls per process; defaults to
+                                  256 under gevent (the app's own default is 16)
+    QUIZ_STATE_BACKEND            defaults to mongo when GUNICORN_WORKERS > 1, since
+                                  the in-memory quiz state is per process (pending
+                                  chat streams follow the same setting)
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count())))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# AI calls retry with backoff for up to a couple of minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+
+# the app is imported in each worker after gevent has patched the stdlib;
+# preloading it in the master would create locks and sockets unpatched
+preload_app = False
+
+if worker_class == "gevent":
+    os.environ.setdefault("OPENAI_MAX_CONCURRENCY", "256")
+
+# a quiz started on one worker must be visible to the next request's worker
+if workers > 1:
+    os.environ.setdefault("QUIZ_STATE_BACKEND", "mongo")
@@ -0,0 +1,163 @@
+"""
+In-process latency metrics exported in Prometheus text format.
+
+    with stage("pdf.render"):
+        ...
+
+    @timed_stage("openai.chatbot")
+    def call_openai_chatbot(...): ...
+
+Stage timings go to the eye_stage_duration_seconds histogram and, while a
+request is being tracked on the current thread (begin_request/end_request),
+are also summed per stage so slow requests can be logged with a breakdown.
+Values are per process; with several gunicorn workers each one exposes its own.
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_histograms = {}   # name -> {labels tuple: [bucket counts..., sum, count]}
+_counters = {}     # name -> {labels tuple: value}
+_help = {}
+_local = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name, value, help_text="", **labels):
+    key = _label_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        row = series.get(key)
+        if row is None:
+            row = series[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+        if help_text:
+            _help.setdefault(name, help_text)
+
+
+def inc(name, amount=1, help_text="", **labels):
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+        if help_text:
+            _help.setdefault(name, help_text)
+
+
+# -------------------- Per-request stage breakdown --------------------
+def begin_request():
+    _local.stages = {}
+    _local.started = time.perf_counter()
+
+
+def end_request():
+    """Return (elapsed seconds, {stage: seconds}) for the request tracked on this thread."""
+    stages = getattr(_local, "stages", None) or {}
+    started = getattr(_local, "started", None)
+    _local.stages = None
+    _local.started = None
+    return (time.perf_counter() - started if started else 0.0), stages
+
+
+def record_stage(name, seconds):
+    observe("eye_stage_duration_seconds", seconds, "Time spent in named stages", stage=name)
+    stages = getattr(_local, "stages", None)
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def timed_stage(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# -------------------- Mongo --------------------
+class MongoStageListener(monitoring.CommandListener):
+    """Times every Mongo command as stage mongo.<collection>.<command>."""
+
+    def __init__(self):
+        self._names = {}
+        self._names_lock = threading.Lock()
+
+    def started(self, event):
+        coll = event.command.get(event.command_name)
+        name = f"mongo.{coll}.{event.command_name}" if isinstance(coll, str) else f"mongo.{event.command_name}"
+        with self._names_lock:
+            self._names[(event.connection_id, event.request_id)] = name
+
+    def _finish(self, event):
+        with self._names_lock:
+            name = self._names.pop((event.connection_id, event.request_id), f"mongo.{event.command_name}")
+        record_stage(name, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+        inc("eye_mongo_errors_total", help_text="Failed Mongo commands", command=event.command_name)
+
+
+# -------------------- Export --------------------
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+def render_prometheus(gauges=None):
+    """Prometheus text exposition (format 0.0.4) of all metrics, plus optional {name: value} gauges."""
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_fmt_labels(key)} {value}")
+
+        for name, series in sorted(_histograms.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, row in sorted(series.items()):
+                for bound, count in zip(DEFAULT_BUCKETS, row):
+                    lines.append(f"{name}_bucket{_fmt_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {row[-1]}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {row[-2]}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {row[-1]}")
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
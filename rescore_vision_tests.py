@@ -0,0 +1,75 @@
+"""
+Re-score stored vision quiz results after the scoring rules change.
+Run:
+    python rescore_vision_tests.py                 # only docs scored by an older SCORING_VERSION
+    python rescore_vision_tests.py --all           # every doc
+    python rescore_vision_tests.py --dry-run       # report counts, write nothing
+    python rescore_vision_tests.py --batch-size 1000
+
+Streams vision_tests with a cursor and writes changes back with bulk_write,
+one round trip per batch. Users whose score/risk changed get their
+user_summaries entry rebuilt afterwards so latest_quizzes matches.
+"""
+
+import argparse
+
+from pymongo import UpdateOne
+
+from app import rebuild_user_summary, vision_col
+from vision_scoring import SCORING_VERSION, rescore_breakdown
+
+PROJECTION = {"breakdown": 1, "score": 1, "risk": 1, "username": 1}
+
+
+def rescore(batch_size=500, rescore_all=False, dry_run=False):
+    query = {} if rescore_all else {"scoring_version": {"$ne": SCORING_VERSION}}
+    cursor = vision_col.find(query, PROJECTION, no_cursor_timeout=True).batch_size(batch_size)
+
+    seen = changed = 0
+    ops = []
+    users = set()
+    try:
+        for doc in cursor:
+            seen += 1
+            result = rescore_breakdown(doc.get("breakdown") or [])
+            if result["score"] != doc.get("score") or result["risk"] != doc.get("risk"):
+                changed += 1
+                if doc.get("username"):
+                    users.add(doc["username"])
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "score": result["score"],
+                "risk": result["risk"],
+                "breakdown": result["breakdown"],
+                "insights": result["insights"],
+                "weak_areas": result["weak_areas"],
+                "scoring_version": result["scoring_version"],
+            }}))
+            if len(ops) >= batch_size:
+                if not dry_run:
+                    vision_col.bulk_write(ops, ordered=False)
+                ops = []
+        if ops and not dry_run:
+            vision_col.bulk_write(ops, ordered=False)
+    finally:
+        cursor.close()
+
+    if not dry_run:
+        for username in users:
+            rebuild_user_summary(username)
+    return seen, changed, len(users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--all", action="store_true", help="rescore docs already at the current version")
+    parser.add_argument("--dry-run", action="store_true", help="don't write anything")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    seen, changed, users = rescore(args.batch_size, args.all, args.dry_run)
+    print(f"✔ Rescored {seen} results ({changed} changed score/risk, {users} user summaries) to scoring v{SCORING_VERSION}"
+          + (" [dry run]" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
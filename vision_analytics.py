@@ -0,0 +1,207 @@
+"""
+Vision quiz analytics computed server-side with Mongo aggregation pipelines.
+
+    trend = user_trend(vision_col, "alice")            # last 10 scores + rolling average
+    weak = user_weak_areas(vision_col, "alice")        # misses per category from breakdowns
+    pop = population_summary(vision_col, days=90)      # histogram, percentiles, daily means
+
+Only aggregated rows (at most ~100 per chart) leave the database. Results are
+cached per process in time buckets: an entry is reused until the wall clock
+crosses into the next bucket_seconds window, or until invalidate_user() drops
+a user's entries after a new quiz. user_trend uses $setWindowFields and so
+needs MongoDB 5.0+.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from vision_scoring import DEFAULT_WEAK_AREA, WEAK_AREA_BY_CATEGORY
+
+ROLLING_WINDOW = 3
+PERCENTILES = (10, 25, 50, 75, 90)
+CACHE_MAX_ENTRIES = 1024
+
+_cache = OrderedDict()   # key tuple -> (bucket, value)
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+
+
+# -------------------- Time-bucketed cache --------------------
+def cached(key, bucket_seconds, compute):
+    bucket = int(time.time() // bucket_seconds)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == bucket:
+            _cache.move_to_end(key)
+            cache_stats["hits"] += 1
+            return entry[1]
+        cache_stats["misses"] += 1
+
+    value = compute()
+    with _cache_lock:
+        _cache[key] = (bucket, value)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return value
+
+
+def invalidate_user(username):
+    """Drop every cached result computed for username (call after a new quiz)."""
+    with _cache_lock:
+        for key in [k for k in _cache if k[1] == username]:
+            del _cache[key]
+
+
+def cache_info():
+    return dict(cache_stats, entries=len(_cache))
+
+
+# -------------------- Pipelines --------------------
+SCORED = {"score": {"$type": "number"}}
+
+
+def user_trend_pipeline(username, limit):
+    return [
+        {"$match": dict(SCORED, username=username)},
+        {"$sort": {"created_at": -1}},
+        # fetch extra rows so the oldest plotted point still has a full window
+        {"$limit": limit + ROLLING_WINDOW - 1},
+        {"$setWindowFields": {
+            "sortBy": {"created_at": 1},
+            "output": {"rolling_avg": {
+                "$avg": "$score",
+                "window": {"documents": [-(ROLLING_WINDOW - 1), 0]},
+            }},
+        }},
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {"$sort": {"created_at": 1}},
+        {"$project": {
+            "_id": 0,
+            "score": 1,
+            "risk": 1,
+            # share of questions missed; older code read this but never stored it
+            "risk_pct": {"$subtract": [100, "$score"]},
+            "rolling_avg": {"$round": ["$rolling_avg", 1]},
+            "created_at": {"$dateToString": {"format": "%Y-%m-%dT%H:%M:%S", "date": "$created_at"}},
+        }},
+    ]
+
+
+def weak_area_pipeline(match):
+    return [
+        {"$match": match},
+        {"$project": {"breakdown.category": 1, "breakdown.ok": 1}},
+        {"$unwind": "$breakdown"},
+        {"$group": {
+            "_id": {"$ifNull": ["$breakdown.category", ""]},
+            "answered": {"$sum": 1},
+            "misses": {"$sum": {"$cond": ["$breakdown.ok", 0, 1]}},
+        }},
+        {"$sort": {"misses": -1}},
+    ]
+
+
+def population_pipeline(since):
+    return [
+        {"$match": dict(SCORED, created_at={"$gte": since})},
+        {"$facet": {
+            "histogram": [
+                {"$group": {"_id": "$score", "count": {"$sum": 1}}},
+                {"$sort": {"_id": 1}},
+            ],
+            "risks": [
+                {"$group": {"_id": "$risk", "count": {"$sum": 1}}},
+            ],
+            "daily": [
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                    "avg_score": {"$avg": "$score"},
+                    "tests": {"$sum": 1},
+                }},
+                {"$sort": {"_id": 1}},
+            ],
+            "users": [
+                {"$group": {"_id": "$username"}},
+                {"$count": "n"},
+            ],
+        }},
+    ]
+
+
+# -------------------- Shaping --------------------
+def percentiles_from_histogram(histogram, pcts=PERCENTILES):
+    """Nearest-rank percentiles from [(score, count), ...] sorted by score."""
+    total = sum(c for _, c in histogram)
+    out = {}
+    if not total:
+        return out
+    for p in pcts:
+        rank = max(1, -(-p * total // 100))   # ceil
+        seen = 0
+        for score, count in histogram:
+            seen += count
+            if seen >= rank:
+                out[f"p{p}"] = score
+                break
+    return out
+
+
+def percentile_rank(histogram, score):
+    """Share (0-100) of population scores at or below score."""
+    total = sum(c for _, c in histogram)
+    if not total or score is None:
+        return None
+    at_or_below = sum(c for s, c in histogram if s <= score)
+    return round(100.0 * at_or_below / total, 1)
+
+
+def _weak_area_rows(rows):
+    areas = []
+    for r in rows:
+        answered = r["answered"] or 1
+        areas.append({
+            "category": r["_id"] or "unknown",
+            "area": WEAK_AREA_BY_CATEGORY.get(r["_id"], DEFAULT_WEAK_AREA),
+            "answered": r["answered"],
+            "misses": r["misses"],
+            "miss_rate": round(100.0 * r["misses"] / answered, 1),
+        })
+    return areas
+
+
+# -------------------- Public API --------------------
+def user_trend(col, username, limit=10, bucket_seconds=60):
+    """Oldest-first [{score, risk, risk_pct, rolling_avg, created_at}] of the last `limit` quizzes."""
+    return cached(("trend", username, limit), bucket_seconds,
+                  lambda: list(col.aggregate(user_trend_pipeline(username, limit))))
+
+
+def user_weak_areas(col, username, bucket_seconds=60):
+    return cached(("weak", username), bucket_seconds,
+                  lambda: _weak_area_rows(col.aggregate(weak_area_pipeline(dict(SCORED, username=username)))))
+
+
+def population_summary(col, days=90, bucket_seconds=600):
+    def compute():
+        since = datetime.utcnow() - timedelta(days=days)
+        facets = next(col.aggregate(population_pipeline(since)), {}) or {}
+        histogram = [(r["_id"], r["count"]) for r in facets.get("histogram", [])]
+        tests = sum(c for _, c in histogram)
+        users = facets.get("users") or [{"n": 0}]
+        return {
+            "days": days,
+            "tests": tests,
+            "users": users[0]["n"],
+            "mean_score": round(sum(s * c for s, c in histogram) / tests, 1) if tests else None,
+            "percentiles": percentiles_from_histogram(histogram),
+            "histogram": histogram,
+            "risks": {r["_id"] or "unknown": r["count"] for r in facets.get("risks", [])},
+            "daily": [{"day": r["_id"], "avg_score": round(r["avg_score"], 1), "tests": r["tests"]}
+                      for r in facets.get("daily", [])],
+            "weak_areas": _weak_area_rows(col.aggregate(weak_area_pipeline(dict(SCORED, created_at={"$gte": since})))),
+        }
+    return cached(("population", None, days), bucket_seconds, compute)
@@ -0,0 +1,243 @@
+"""
+Vision quiz scoring.
+
+Pure functions shared by the /vision_quiz/finish route and the
+rescore_vision_tests.py CLI. No Flask or Mongo imports here.
+
+Question categories follow generate_vision_questions.py:
+    1-10  color plate    (Ishihara-like dots)
+    11-20 blur           (blurred words)
+    21-28 peripheral     (dot at an edge)
+    29-34 e_chart        (tumbling E)
+    35-40 shape          (shape recognition)
+Questions added with --bulk (ids above 40, including the "contrast" category)
+carry a "category" column in the workbook, which wins over the id ranges.
+On-demand questions have string ids ("blur-12345") and carry their own
+category and answer.
+"""
+
+import difflib
+import re
+
+# bump when the matching / risk / weak-area rules change; stored on every
+# vision_tests doc so the rescoring CLI knows what is stale
+SCORING_VERSION = 2
+
+CATEGORY_RANGES = [
+    ("color_plate", 1, 10),
+    ("blur", 11, 20),
+    ("peripheral", 21, 28),
+    ("e_chart", 29, 34),
+    ("shape", 35, 40),
+]
+
+WEAK_AREA_BY_CATEGORY = {
+    "color_plate": "Color Sensitivity",
+    "blur": "Contrast Sensitivity",
+    "contrast": "Contrast Sensitivity",
+    "peripheral": "Peripheral Vision",
+    "e_chart": "Visual Acuity",
+    "shape": "Shape Recognition",
+}
+
+DEFAULT_WEAK_AREA = "General visual fatigue"
+
+FUZZY_MAX_LEN = 40
+FUZZY_CUTOFF = 0.78
+
+_IMAGE_ID_RE = re.compile(r"q(\d+)\.png")
+
+
+def _normalize_ans(a):
+    if a is None:
+        return ""
+    s = str(a).strip()
+    # remove repeated whitespace
+    s = " ".join(s.split())
+    # normalize common punctuation
+    s = s.replace("–", "-").replace("—", "-")
+    return s.lower()
+
+
+def _numeric_equal(a, b):
+    # return True if both are numeric and equal as ints
+    try:
+        ai = int(float(a))
+        bi = int(float(b))
+        return ai == bi
+    except Exception:
+        return False
+
+
+def question_key(value):
+    """Question id as stored: int for workbook questions, str for on-demand ones."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value) if value not in (None, "") else None
+
+
+def category_for_id(qid):
+    if not isinstance(qid, int):
+        return ""
+    for name, lo, hi in CATEGORY_RANGES:
+        if lo <= qid <= hi:
+            return name
+    return ""
+
+
+def question_id_from_image(image):
+    """Recover the question id from an image path/URL such as .../questions/q07.png."""
+    m = _IMAGE_ID_RE.search(image or "")
+    return int(m.group(1)) if m else None
+
+
+def build_question_index(questions):
+    """
+    Precompute what scoring needs per question id:
+    {id: {"category": ..., "answer_norm": ...}}
+    """
+    index = {}
+    for q in questions:
+        qid = question_key(q.get("id"))
+        if qid is None:
+            continue
+        index[qid] = {
+            "category": q.get("category") or category_for_id(qid),
+            "answer_norm": _normalize_ans(q.get("answer", "")),
+        }
+    return index
+
+
+def match_answer(correct, user):
+    """Compare two normalized answers. Returns (ok, reason)."""
+    # First try exact normalized match
+    if correct == user and correct != "":
+        return True, "exact match"
+
+    # numeric flexibility: 6 == 06 == "6.0"
+    if _numeric_equal(correct, user):
+        return True, "numeric match"
+
+    # try fuzzy (close match) but only if both are reasonably short text (avoid matching long texts)
+    # use a conservative cutoff so we don't accidentally mark wrong answers correct
+    if not correct or not user or len(correct) > FUZZY_MAX_LEN or len(user) > FUZZY_MAX_LEN:
+        return False, "no match (length or empty)"
+    ratio = difflib.SequenceMatcher(None, correct, user).ratio()
+    if ratio >= FUZZY_CUTOFF:
+        return True, f"fuzzy match (ratio={ratio:.2f})"
+    return False, f"no match (ratio={ratio:.2f})"
+
+
+def risk_label(correct_count, total):
+    if correct_count <= total * 0.4:
+        return "High"
+    if correct_count <= total * 0.7:
+        return "Moderate"
+    return "Low"
+
+
+def insights_for(risk):
+    if risk == "Low":
+        return ["Overall vision appears healthy."]
+    if risk == "Moderate":
+        return ["Mild visual stress detected. Monitor eye habits."]
+    return ["High visual strain detected. Professional consultation advised."]
+
+
+def _weak_areas_for(entry):
+    areas = []
+    area = WEAK_AREA_BY_CATEGORY.get(entry.get("category", ""))
+    if area:
+        areas.append(area)
+    text = (entry.get("prompt") or "").lower()
+    if "contrast" in text:
+        areas.append("Contrast Sensitivity")
+    if "moving" in text or "tracking" in text:
+        areas.append("Visual Tracking")
+    if "color" in text:
+        areas.append("Color Sensitivity")
+    return areas
+
+
+def summarize(breakdown):
+    """Score, risk, weak areas and insights from already-matched breakdown entries."""
+    total = len(breakdown)
+    correct_count = sum(1 for b in breakdown if b["ok"])
+
+    weak = set()
+    for b in breakdown:
+        if not b["ok"]:
+            weak.update(_weak_areas_for(b))
+    weak_areas = sorted(weak) or [DEFAULT_WEAK_AREA]
+
+    risk = risk_label(correct_count, total)
+    return {
+        "correct": correct_count,
+        "total": total,
+        "score": int(round((correct_count / max(1, total)) * 100)),
+        "risk": risk,
+        "weak_areas": weak_areas,
+        "insights": insights_for(risk),
+        "scoring_version": SCORING_VERSION,
+    }
+
+
+def score_quiz(questions, answers, index):
+    """
+    Score one quiz in a single pass.
+    questions: question records in quiz order, answers: {"<idx>": user answer},
+    index: build_question_index() output.
+    Returns summarize() output plus "breakdown".
+    """
+    breakdown = []
+    for i, q in enumerate(questions):
+        qid = question_key(q.get("id")) or 0
+        meta = index.get(qid) or {}
+        correct_raw = q.get("answer", "")
+        user_raw = answers.get(str(i), "")  # answers stored as strings keyed by index
+
+        correct = meta.get("answer_norm") if meta else _normalize_ans(correct_raw)
+        user = _normalize_ans(user_raw)
+        ok, reason = match_answer(correct, user)
+
+        # Build breakdown entry (include raw values so you can debug)
+        breakdown.append({
+            "index": i,
+            "question_id": qid,
+            "category": meta.get("category") or q.get("category") or category_for_id(qid),
+            "image": q.get("image", ""),
+            "prompt": q.get("prompt", ""),
+            "correct_raw": correct_raw,
+            "user_raw": user_raw,
+            "correct_norm": correct,
+            "user_norm": user,
+            "ok": ok,
+            "reason": reason
+        })
+
+    result = summarize(breakdown)
+    result["breakdown"] = breakdown
+    return result
+
+
+def rescore_breakdown(breakdown):
+    """
+    Re-apply the current rules to a stored breakdown (from vision_tests).
+    Older docs lack question_id/category; those are recovered from the image path.
+    """
+    fresh = []
+    for b in breakdown:
+        entry = dict(b)
+        qid = entry.get("question_id") or question_id_from_image(entry.get("image"))
+        if qid:
+            entry["question_id"] = qid
+            entry["category"] = entry.get("category") or category_for_id(qid)
+        entry["correct_norm"] = _normalize_ans(entry.get("correct_raw", ""))
+        entry["user_norm"] = _normalize_ans(entry.get("user_raw", ""))
+        entry["ok"], entry["reason"] = match_answer(entry["correct_norm"], entry["user_norm"])
+        fresh.append(entry)
+
+    result = summarize(fresh)
+    result["breakdown"] = fresh
+    return result
@@ -0,0 +1,59 @@
+"""
+Precompute the vision quiz AI reports for every (score, total, weak areas) input.
+Run:
+    python warm_vision_reports.py               # fill missing rows for the current prompt version
+    python warm_vision_reports.py --refresh     # regenerate every row
+    python warm_vision_reports.py --dry-run     # only count the combinations
+    python warm_vision_reports.py --prune       # also delete rows from older prompt versions
+
+Rows are keyed by VISION_REPORT_VERSION, so after editing VISION_AI_PROMPT a
+plain run builds the new table and /vision_quiz/finish stops using the old one.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+from app import (QUIZ_SIZE, VISION_REPORT_VERSION, vision_ai_report,
+                 vision_report_key, vision_reports_col)
+from vision_scoring import DEFAULT_WEAK_AREA, WEAK_AREA_BY_CATEGORY
+
+
+def all_inputs(total=QUIZ_SIZE):
+    """Every (score, total, weak_areas) summarize() can produce for a quiz of `total`."""
+    areas = sorted(set(WEAK_AREA_BY_CATEGORY.values()))
+    for score in range(total + 1):
+        wrong = total - score
+        yield score, total, [DEFAULT_WEAK_AREA]
+        for k in range(1, min(wrong, len(areas)) + 1):
+            for combo in combinations(areas, k):
+                yield score, total, list(combo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--total", type=int, default=QUIZ_SIZE)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--refresh", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--prune", action="store_true")
+    args = parser.parse_args()
+
+    inputs = list(all_inputs(args.total))
+    if not args.refresh:
+        have = {d["_id"] for d in vision_reports_col.find({"version": VISION_REPORT_VERSION}, {"_id": 1})}
+        inputs = [i for i in inputs if vision_report_key(*i) not in have]
+
+    print(f"{len(inputs)} reports to generate (version {VISION_REPORT_VERSION})")
+    if not args.dry_run and inputs:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            list(pool.map(lambda i: vision_ai_report(*i, refresh=args.refresh), inputs))
+        print("✔ Vision report table warmed")
+
+    if args.prune and not args.dry_run:
+        res = vision_reports_col.delete_many({"version": {"$ne": VISION_REPORT_VERSION}})
+        print(f"✔ Pruned {res.deleted_count} stale reports")
+
+
+if __name__ == "__main__":
+    main()